@@ -13,6 +13,7 @@ Usage:
     python scripts/test_call.py                     # Listen for greeting, then interactive text input
     python scripts/test_call.py --audio sample.wav  # Send a pre-recorded WAV file
     python scripts/test_call.py --save output.raw   # Save received audio to file
+    python scripts/test_call.py --audio sample.wav --batch 5  # 5 chunks (100ms) per media event
 
     # Or test without any audio (just AI + RAG + tools):
     curl -X POST http://localhost:8000/test/chat \\
@@ -30,8 +31,8 @@ Full phone test (Twilio + ngrok):
 import argparse
 import asyncio
 import base64
+import binascii
 import json
-import struct
 import sys
 import time
 from pathlib import Path
@@ -42,36 +43,55 @@ except ImportError:
     print("Error: websockets package required. Install with: pip install websockets")
     sys.exit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    print("Error: numpy package required. Install with: pip install numpy")
+    sys.exit(1)
 
-# mu-law encoding table for converting linear PCM to mu-law
-def linear_to_mulaw(sample: int) -> int:
-    """Convert a 16-bit linear PCM sample to 8-bit mu-law"""
-    MULAW_MAX = 0x1FFF
-    MULAW_BIAS = 33
-    sign = 0
+# orjson parses inbound frames several times faster; fall back to stdlib json
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+# mu-law exponent thresholds, ascending for np.searchsorted
+_MULAW_EXP_THRESHOLDS = np.array([0x0100, 0x0200, 0x0400, 0x0800, 0x1000, 0x2000, 0x4000])
+_MULAW_BIAS = 33
+_MULAW_MAX = 0x1FFF
 
-    if sample < 0:
-        sample = -sample
-        sign = 0x80
 
-    sample = min(sample + MULAW_BIAS, MULAW_MAX)
+def linear_to_mulaw_array(samples: np.ndarray) -> np.ndarray:
+    """Convert 16-bit linear PCM samples to 8-bit mu-law (vectorized)"""
+    samples = samples.astype(np.int32)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples) + _MULAW_BIAS, _MULAW_MAX)
 
-    exponent = 7
-    for exp_val in [0x4000, 0x2000, 0x1000, 0x0800, 0x0400, 0x0200, 0x0100]:
-        if sample >= exp_val:
-            break
-        exponent -= 1
+    # Exponent == number of thresholds the biased magnitude reaches
+    exponent = np.searchsorted(_MULAW_EXP_THRESHOLDS, magnitude, side="right")
 
-    mantissa = (sample >> (exponent + 3)) & 0x0F
-    mulaw_byte = ~(sign | (exponent << 4) | mantissa) & 0xFF
-    return mulaw_byte
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+# Full int16 -> mu-law table (64 KiB), indexed by the sample's uint16 bit pattern.
+# Built once at import so encoding is a single gather, scalar or batched.
+_MULAW_LUT = linear_to_mulaw_array(np.arange(65536, dtype=np.uint16).view(np.int16))
+
+
+def linear_to_mulaw(sample: int) -> int:
+    """Convert a 16-bit linear PCM sample to 8-bit mu-law"""
+    sample = max(-32768, min(sample, 32767))
+    return int(_MULAW_LUT[sample & 0xFFFF])
 
 
 def generate_silence_mulaw(duration_ms: int, sample_rate: int = 8000) -> bytes:
     """Generate silence in mu-law format"""
     num_samples = int(sample_rate * duration_ms / 1000)
     # mu-law silence is 0xFF (linear zero maps to 0xFF in mu-law)
-    return bytes([0xFF] * num_samples)
+    return b"\xff" * num_samples
 
 
 def wav_to_mulaw(wav_path: str) -> bytes:
@@ -90,29 +110,41 @@ def wav_to_mulaw(wav_path: str) -> bytes:
 
     # Convert to 16-bit samples
     if sample_width == 1:
-        samples = [(b - 128) * 256 for b in frames]
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) * 256
     elif sample_width == 2:
-        samples = list(struct.unpack(f'<{len(frames)//2}h', frames))
+        samples = np.frombuffer(frames, dtype='<i2', count=len(frames) // 2)
     else:
         print(f"Unsupported sample width: {sample_width}")
         return b''
 
-    # Convert each sample to mu-law
-    mulaw_bytes = bytes([linear_to_mulaw(s) for s in samples])
-    return mulaw_bytes
+    # Convert all samples to mu-law with one table lookup per sample
+    return _MULAW_LUT[samples.view(np.uint16)].tobytes()
+
+
+# Media event envelope; only the base64 payload changes per message
+_MEDIA_PREFIX = b'{"event":"media","media":{"payload":"'
+_MEDIA_SUFFIX = b'"}}'
+
+# Markers for slicing the payload out of the server's compact media events
+_MEDIA_EVENT_START = '{"event":"media"'
+_PAYLOAD_KEY = '"payload":"'
 
 
 class TwilioSimulator:
     """Simulates Twilio's Media Stream WebSocket protocol"""
 
     def __init__(self, server_url: str = "ws://localhost:8000/ws/media",
-                 save_path: str = None):
+                 save_path: str = None, batch: int = 1, binary: bool = False):
         self.server_url = server_url
         self.save_path = save_path
+        self.batch = max(1, batch)
+        # Raw mu-law binary frames instead of base64 JSON (local server only)
+        self.binary = binary
         self.call_sid = f"TEST_CALL_{int(time.time())}"
         self.stream_sid = f"TEST_STREAM_{int(time.time())}"
         self.ws = None
-        self.received_audio = bytearray()
+        self._chunks: list[bytes] = []
+        self._total_len = 0
         self.is_connected = False
         self.greeting_received = asyncio.Event()
 
@@ -132,28 +164,44 @@ class TwilioSimulator:
                 "streamSid": self.stream_sid
             }
         }
+        if self.binary:
+            start_event["start"]["customParameters"] = {"binaryFrames": "true"}
         await self.ws.send(json.dumps(start_event))
         print("Sent 'start' event - waiting for greeting...")
 
+    def encode_audio(self, audio_data: bytes, chunk_size: int = 160) -> list:
+        """
+        Encode audio data as Twilio media event messages (160 bytes = 20ms at 8kHz).
+        With batch > 1, that many chunks are packed into each media event.
+        """
+        message_size = chunk_size * self.batch
+        messages = []
+        for i in range(0, len(audio_data), message_size):
+            chunk = audio_data[i:i + message_size]
+            if self.binary:
+                # websockets sends bytes as a binary frame; no envelope needed
+                messages.append(chunk)
+                continue
+            payload = binascii.b2a_base64(chunk, newline=False)
+            # Decode so websockets sends a text frame, as Twilio does
+            messages.append((_MEDIA_PREFIX + payload + _MEDIA_SUFFIX).decode("ascii"))
+        return messages
+
+    async def send_encoded(self, messages: list):
+        """Send pre-encoded media events, paced in real time"""
+        interval = 0.02 * self.batch
+        for message in messages:
+            await self.ws.send(message)
+
+            # Simulate real-time: 20ms per chunk
+            await asyncio.sleep(interval)
+
     async def send_audio(self, audio_data: bytes, chunk_size: int = 160):
-        """Send audio data as Twilio media events (160 bytes = 20ms at 8kHz)"""
+        """Send audio data as Twilio media events"""
         total_chunks = len(audio_data) // chunk_size
         print(f"Sending {len(audio_data)} bytes of audio ({total_chunks} chunks, ~{total_chunks * 20}ms)...")
 
-        for i in range(0, len(audio_data), chunk_size):
-            chunk = audio_data[i:i + chunk_size]
-            payload = base64.b64encode(chunk).decode("utf-8")
-
-            media_event = {
-                "event": "media",
-                "media": {
-                    "payload": payload
-                }
-            }
-            await self.ws.send(json.dumps(media_event))
-
-            # Simulate real-time: 20ms per chunk
-            await asyncio.sleep(0.02)
+        await self.send_encoded(self.encode_audio(audio_data, chunk_size))
 
         print("Audio sent!")
 
@@ -163,30 +211,47 @@ class TwilioSimulator:
         await self.ws.send(json.dumps(stop_event))
         print("Sent 'stop' event")
 
+    def _add_audio(self, audio_bytes: bytes):
+        """Record a received audio chunk and report progress"""
+        self._chunks.append(audio_bytes)
+        self._total_len += len(audio_bytes)
+
+        if len(self._chunks) % 50 == 0:
+            duration_ms = self._total_len / 8  # 8000 Hz = 8 bytes/ms
+            print(f"  Receiving audio... ({duration_ms:.0f}ms so far)")
+
     async def receive_messages(self):
         """Receive and process messages from the server"""
-        audio_chunk_count = 0
-
         try:
             async for message in self.ws:
-                data = json.loads(message)
+                if isinstance(message, bytes):
+                    # Binary mode: the frame is the raw mu-law audio
+                    self._add_audio(message)
+                    continue
+
+                # Fast path for media events (nearly every frame): slice the
+                # payload out of the compact JSON instead of parsing it
+                if message.startswith(_MEDIA_EVENT_START):
+                    start = message.find(_PAYLOAD_KEY)
+                    if start != -1:
+                        start += len(_PAYLOAD_KEY)
+                        payload = message[start:message.index('"', start)]
+                        if payload:
+                            self._add_audio(binascii.a2b_base64(payload))
+                        continue
+
+                data = _loads(message)
                 event = data.get("event")
 
                 if event == "media":
                     # Decode and save audio
                     payload = data.get("media", {}).get("payload", "")
                     if payload:
-                        audio_bytes = base64.b64decode(payload)
-                        self.received_audio.extend(audio_bytes)
-                        audio_chunk_count += 1
-
-                        if audio_chunk_count % 50 == 0:
-                            duration_ms = len(self.received_audio) / 8  # 8000 Hz = 8 bytes/ms
-                            print(f"  Receiving audio... ({duration_ms:.0f}ms so far)")
+                        self._add_audio(base64.b64decode(payload))
 
                 elif event == "mark":
                     mark_name = data.get("mark", {}).get("name", "")
-                    duration_ms = len(self.received_audio) / 8
+                    duration_ms = self._total_len / 8
                     print(f"  Mark: '{mark_name}' (total audio: {duration_ms:.0f}ms)")
 
                     if mark_name == "greeting_end":
@@ -203,16 +268,21 @@ class TwilioSimulator:
 
         self.is_connected = False
 
+    @property
+    def received_audio(self) -> bytes:
+        """All received audio, joined on demand"""
+        return b"".join(self._chunks)
+
     async def save_audio(self):
         """Save received audio to file"""
-        if self.received_audio and self.save_path:
+        if self._total_len and self.save_path:
             Path(self.save_path).write_bytes(self.received_audio)
-            duration_s = len(self.received_audio) / 8000
-            print(f"\nSaved {len(self.received_audio)} bytes ({duration_s:.1f}s) to {self.save_path}")
+            duration_s = self._total_len / 8000
+            print(f"\nSaved {self._total_len} bytes ({duration_s:.1f}s) to {self.save_path}")
             print(f"Play with: ffplay -f mulaw -ar 8000 -ac 1 {self.save_path}")
-        elif self.received_audio:
-            duration_s = len(self.received_audio) / 8000
-            print(f"\nReceived {len(self.received_audio)} bytes of audio ({duration_s:.1f}s)")
+        elif self._total_len:
+            duration_s = self._total_len / 8000
+            print(f"\nReceived {self._total_len} bytes of audio ({duration_s:.1f}s)")
             print("Use --save output.raw to save it")
 
     async def close(self):
@@ -224,7 +294,8 @@ class TwilioSimulator:
 
 async def run_audio_test(args):
     """Run a test with audio file input"""
-    sim = TwilioSimulator(server_url=args.url, save_path=args.save)
+    sim = TwilioSimulator(server_url=args.url, save_path=args.save, batch=args.batch,
+                          binary=args.binary)
 
     try:
         await sim.connect()
@@ -276,7 +347,8 @@ async def run_audio_test(args):
 
 async def run_interactive(args):
     """Run interactive text mode - type messages, hear responses"""
-    sim = TwilioSimulator(server_url=args.url, save_path=args.save)
+    sim = TwilioSimulator(server_url=args.url, save_path=args.save, batch=args.batch,
+                          binary=args.binary)
 
     try:
         await sim.connect()
@@ -307,12 +379,13 @@ async def run_interactive(args):
         print("Press Ctrl+C to end the call.")
         print("=" * 60 + "\n")
 
-        # Keep connection alive
+        # Keep connection alive. The keepalive payload is constant, so
+        # encode it once and resend the same messages every tick.
+        keepalive = sim.encode_audio(generate_silence_mulaw(100))  # 100ms silence
         try:
             while sim.is_connected:
                 # Send keepalive silence every 5 seconds
-                silence = generate_silence_mulaw(100)  # 100ms silence
-                await sim.send_audio(silence)
+                await sim.send_encoded(keepalive)
                 await asyncio.sleep(5)
         except (KeyboardInterrupt, asyncio.CancelledError):
             pass
@@ -332,6 +405,15 @@ async def run_interactive(args):
         await sim.close()
 
 
+def run(coro):
+    """Run the client on uvloop when installed (faster WebSocket I/O), else stock asyncio"""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    return uvloop.run(coro)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Test the Voice AI Agent by simulating Twilio's WebSocket protocol",
@@ -341,6 +423,7 @@ Examples:
   python scripts/test_call.py                         # Connect and listen for greeting
   python scripts/test_call.py --audio sample.wav      # Send audio file
   python scripts/test_call.py --save output.raw       # Save received audio
+  python scripts/test_call.py --audio sample.wav --batch 5  # 100ms per media event
 
   # Play saved audio:
   ffplay -f mulaw -ar 8000 -ac 1 output.raw
@@ -365,13 +448,19 @@ Full phone test (Twilio + ngrok):
                         help="Path to WAV file to send (must be 8kHz mono)")
     parser.add_argument("--save", type=str,
                         help="Save received audio to file (mu-law raw format)")
+    parser.add_argument("--binary", action="store_true",
+                        help="Exchange raw mu-law binary frames instead of base64 JSON "
+                             "(local server only; Twilio always uses JSON)")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="20ms audio chunks per media event (default: 1 for strict "
+                             "realtime, e.g. 5 for 100ms throughput mode)")
 
     args = parser.parse_args()
 
     if args.audio:
-        asyncio.run(run_audio_test(args))
+        run(run_audio_test(args))
     else:
-        asyncio.run(run_interactive(args))
+        run(run_interactive(args))
 
 
 if __name__ == "__main__":
@@ -3,32 +3,413 @@ AI Agent - Claude integration with streaming and tool calling
 Manages conversation, RAG, and function execution
 """
 
+import asyncio
+import contextlib
+import functools
 import os
+import re
 import logging
-import json
-from typing import AsyncIterator, Dict, List, Optional, Any
+import time
+from collections import OrderedDict
 from datetime import datetime
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
 
-from anthropic import AsyncAnthropic
+import httpx
+import numpy as np
+import orjson
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient, Timeout
 
 from knowledge_base import KnowledgeBase
 from tools import AppointmentManager, EscalationHandler
 
 logger = logging.getLogger(__name__)
 
+# Most recent messages sent to Claude per request (6 exchanges). Bounds
+# prefill tokens on long calls; the full history is still kept as a list
+# because the server rolls it back by slice on interrupts.
+MAX_HISTORY_MESSAGES = 12
+
+# Tools whose result is spoken directly (confirmation or lookup), phrased by
+# _spoken_tool_reply. Escalation and errors still go back to Claude.
+_DIRECT_RESPONSE_TOOLS = frozenset({"book_appointment", "check_appointment"})
+
+_WEEKDAYS_ES = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+_MONTHS_ES = ("enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+              "agosto", "septiembre", "octubre", "noviembre", "diciembre")
+
+# Anthropic's ephemeral prompt cache lives ~5 minutes and is refreshed on
+# every hit, so one warmup per process is enough while calls keep coming.
+# Re-warm a bit before expiry after an idle period.
+_CACHE_WARM_INTERVAL = 240.0
+# Time of the last successful warmup, and the warmup in flight (if any) so
+# calls starting together don't each send one
+_last_cache_warm = 0.0
+_cache_warm_task: Optional[asyncio.Task] = None
+
+# Text replies reused across calls when a caller says the same thing in the
+# same context (in practice, the same opening question). Opt-in LRU of
+# (normalized utterance, context hash) -> (reply, unit utterance embedding
+# or None, expiry time); 0 (the default) disables it. Entries expire after
+# RESPONSE_CACHE_TTL seconds so a changed knowledge base or schedule isn't
+# answered from a stale reply for long. With the knowledge base's OpenAI
+# embeddings and RESPONSE_CACHE_SIMILARITY set (unset by default: it trades
+# correctness for latency), a differently worded utterance in the same
+# context also matches when its cosine similarity reaches that threshold
+# and it names the same numbers, dates and weekdays.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "0"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+_similarity = os.getenv("RESPONSE_CACHE_SIMILARITY")
+RESPONSE_CACHE_SIMILARITY: Optional[float] = float(_similarity) if _similarity else None
+_response_cache: "OrderedDict[Tuple[str, int], Tuple[str, Optional[np.ndarray], float]]" = OrderedDict()
+
+
+# Tool definitions for Claude API. Static, so built once at import instead
+# of on every turn; the same tuple goes on every request so the cached
+# prefix matches byte-for-byte.
+_TOOL_DEFINITIONS = (
+    {
+        "name": "book_appointment",
+        "description": "Book an appointment for a customer. Requires date, time, customer name, and phone number.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "date": {
+                    "type": "string",
+                    "description": "Appointment date in YYYY-MM-DD format"
+                },
+                "time": {
+                    "type": "string",
+                    "description": "Appointment time in HH:MM format (24-hour)"
+                },
+                "name": {
+                    "type": "string",
+                    "description": "Customer name"
+                },
+                "phone": {
+                    "type": "string",
+                    "description": "Customer phone number"
+                }
+            },
+            "required": ["date", "time", "name", "phone"]
+        }
+    },
+    {
+        "name": "check_appointment",
+        "description": "Check appointment status for a customer by phone number.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "phone": {
+                    "type": "string",
+                    "description": "Customer phone number"
+                }
+            },
+            "required": ["phone"]
+        }
+    },
+    {
+        "name": "escalate_to_human",
+        "description": "Escalate the call to a human support agent. Use when the customer needs help beyond your capabilities.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "reason": {
+                    "type": "string",
+                    "description": "Reason for escalation"
+                },
+                "callback_number": {
+                    "type": "string",
+                    "description": "Customer callback number"
+                }
+            },
+            "required": ["reason"]
+        },
+        # Cache breakpoint on the last tool: tools lead the cached prefix, so
+        # they stay cached on their own even when the system prompt changes
+        "cache_control": {"type": "ephemeral"}
+    }
+)
+
+# One HTTP/2 connection pool shared by every call's Anthropic client, so
+# turns and new calls reuse warm TLS connections instead of handshaking.
+# Keep-alive outlasts the pauses between turns (httpx defaults to 5s).
+_http_client: Optional[DefaultAsyncHttpxClient] = None
+
+
+def _shared_http_client() -> DefaultAsyncHttpxClient:
+    """Return the process-wide HTTP client for Anthropic, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300.0),
+            timeout=Timeout(30.0, connect=5.0)
+        )
+    return _http_client
+
+
+# Tool backends shared by every call: one in-memory appointment book instead of
+# a per-call copy re-read from disk and overwritten by whichever call saves last
+_tool_backends: Optional[Tuple[AppointmentManager, EscalationHandler]] = None
+
+
+def _shared_tool_backends() -> Tuple[AppointmentManager, EscalationHandler]:
+    """Return the process-wide tool backends, creating them on first use"""
+    global _tool_backends
+    if _tool_backends is None:
+        _tool_backends = (AppointmentManager(), EscalationHandler())
+    return _tool_backends
+
+
+# Formulaic utterances answered locally, skipping the Claude round trip.
+# Patterns match the whole utterance (Deepgram adds punctuation), so
+# "hola, quiero una cita" still goes to Claude.
+_FAST_PATHS = (
+    (re.compile(r"^[\s¡!¿]*(hola|buen[oa]s(\s+(d[ií]as|tardes|noches))?)[\s.,!]*$", re.IGNORECASE),
+     "Hola, ¿en qué puedo ayudarle?"),
+    (re.compile(r"^[\s¡!]*(muchas\s+)?gracias[\s.,!]*$", re.IGNORECASE),
+     "Con gusto. ¿Hay algo más en lo que pueda ayudarle?"),
+    (re.compile(r"^[\s¡!]*(adi[oó]s|hasta\s+luego|chao)[\s.,!]*$", re.IGNORECASE),
+     "Gracias por llamar al Centro de Medicina Regenerativa. Que tenga un buen día."),
+)
+
+
+# Every canned reply, so callers can pre-render their audio
+FAST_PATH_REPLIES = tuple(reply for _, reply in _FAST_PATHS)
+
+
+def fast_path_reply(user_message: str) -> Optional[str]:
+    """Return a canned reply for a formulaic utterance, or None"""
+    for pattern, reply in _FAST_PATHS:
+        if pattern.match(user_message):
+            return reply
+    return None
+
+
+# Interim transcripts that read as a finished sentence are worth answering
+# speculatively; shorter ones are usually the start of a longer utterance
+_SPECULATION_MIN_CHARS = 8
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def _normalize_utterance(text: str) -> str:
+    """Lowercased words only, so interim and final transcripts that differ
+    in punctuation or casing compare equal"""
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+# Words whose difference changes the answer even when the embeddings of two
+# utterances are close ("¿abren el lunes?" vs "¿abren el martes?")
+_ANCHOR_RE = re.compile(
+    r"\d+|uno|una|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez|once|doce"
+    r"|trece|catorce|quince|veinte|treinta|media|cuarto"
+    r"|lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bados?|domingos?"
+    r"|enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre"
+    r"|noviembre|diciembre|hoy|ma[nñ]ana|pasado|ayer|semana|mes"
+)
+
+
+def _anchor_words(utterance: str) -> frozenset:
+    """Numbers, dates and weekdays named in a normalized utterance"""
+    return frozenset(word for word in utterance.split() if _ANCHOR_RE.fullmatch(word))
+
+
+def _cached_reply(cache_key: Tuple[str, int]) -> Optional[str]:
+    """Unexpired reply cached under cache_key, refreshing its LRU position"""
+    entry = _response_cache.get(cache_key)
+    if entry is None:
+        return None
+    if entry[2] <= time.monotonic():
+        del _response_cache[cache_key]
+        return None
+    _response_cache.move_to_end(cache_key)
+    return entry[0]
+
+
+def _spoken_date(date: str) -> Optional[str]:
+    """'2026-10-20' as 'martes 20 de octubre'; None if it isn't an ISO date"""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    return f"{_WEEKDAYS_ES[day.weekday()]} {day.day} de {_MONTHS_ES[day.month - 1]}"
+
+
+def _spoken_tool_reply(name: str, result: Dict) -> Optional[str]:
+    """
+    Reply to speak for a direct-response tool's result, without the ISO
+    dates and full appointment IDs of its "message". None means Claude
+    should phrase it.
+    """
+    if not result.get("success"):
+        # A lookup that found nothing is already plain prose; errors aren't
+        return result.get("message") if name == "check_appointment" else None
+
+    appointment = (result.get("appointment") or {}) if name == "check_appointment" else result
+    when = _spoken_date(appointment.get("date"))
+    if when is None or not appointment.get("time"):
+        return None
+    if name == "book_appointment":
+        # The last digits are enough for the caller to quote; read one by one
+        code = " ".join(result.get("appointment_id", "")[-4:])
+        if not code:
+            return None
+        return (f"Listo, su cita queda confirmada para el {when} a las {appointment['time']}. "
+                f"Su código de confirmación es {code}.")
+    if not appointment.get("name"):
+        return None
+    return f"Tiene una cita a nombre de {appointment['name']} el {when} a las {appointment['time']}."
+
+
+def _task_result(task: Optional[asyncio.Task]) -> Any:
+    """Result of a finished, successful task; None otherwise"""
+    if task is None or not task.done() or task.cancelled() or task.exception():
+        return None
+    return task.result()
+
+
+class _TextCoalescer:
+    """
+    Merge Claude's ~1-token text deltas into phrase-sized chunks. A chunk is
+    released at punctuation or once it reaches MIN_CHUNK_CHARS, matching the
+    point where the server hands text to TTS, so no latency is added.
+    """
+
+    __slots__ = ("_parts", "_size")
+
+    BOUNDARY_CHARS = frozenset('.,!?;:\n')
+    MIN_CHUNK_CHARS = 15
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._size = 0
+
+    def push(self, text: str) -> Optional[str]:
+        """Add a delta; return the coalesced chunk if one is ready"""
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.MIN_CHUNK_CHARS or not self.BOUNDARY_CHARS.isdisjoint(text):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """Return any pending text and reset"""
+        if not self._parts:
+            return None
+        chunk = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        return chunk
+
+
+def _with_cache_breakpoint(messages: List[Dict], index: int) -> List[Dict]:
+    """
+    Return a copy of messages whose message at index carries a prompt cache
+    breakpoint on its last content block. History dicts are not mutated.
+    """
+    message = messages[index]
+    content = message["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    else:
+        blocks = list(content)
+        blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+
+    marked = list(messages)
+    marked[index] = {"role": message["role"], "content": blocks}
+    return marked
+
+
+async def _sse_events(response) -> AsyncIterator[SimpleNamespace]:
+    """
+    Parse a Messages API SSE stream into lightweight events with the same
+    attributes process_message reads from the SDK's typed events.
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data: "):
+            continue
+        data = orjson.loads(line[6:])
+        event_type = data["type"]
+        if event_type == "content_block_delta":
+            yield SimpleNamespace(type=event_type, delta=SimpleNamespace(**data["delta"]))
+        elif event_type == "content_block_start":
+            yield SimpleNamespace(type=event_type, content_block=SimpleNamespace(**data["content_block"]))
+        elif event_type == "message_delta":
+            yield SimpleNamespace(type=event_type, delta=SimpleNamespace(**data["delta"]))
+        elif event_type == "error":
+            raise RuntimeError(f"Anthropic stream error: {data['error'].get('message')}")
+        else:
+            yield SimpleNamespace(type=event_type)
+
+
+# Opening line spoken at call start. It is stated in the (cached) system
+# prompt instead of being replayed as an assistant turn on every request.
+GREETING = "Hola, ha llamado al Centro de Medicina Regenerativa. Habla con Ana, ¿cómo puedo ayudarle?"
+
+# Base system prompt optimized for voice conversations; the knowledge base
+# text is appended per agent
+_BASE_SYSTEM_PROMPT = f"""Eres Ana, recepcionista del Centro de Medicina Regenerativa (CMR), hablando en una llamada telefónica en vivo. SIEMPRE responde en español.
+
+REGLA MÁS IMPORTANTE: Sé BREVE. Máximo 1-2 oraciones por respuesta. Responde solo lo que se preguntó, sin información extra ni explicaciones largas. Si el paciente quiere más detalles, los pedirá.
+
+Tu estilo:
+- Clara, directa y amable — no demasiado formal ni robótica
+- Habla como una recepcionista real: natural, eficiente, con buenos modales
+- Habla de usted al paciente
+- Nunca uses markdown, viñetas ni formato — esto se lee en voz alta
+- Si no sabes algo, dilo y ofrece conectarlos con un doctor
+
+Herramientas disponibles:
+- book_appointment: Agendar citas (necesita fecha, hora, nombre, teléfono)
+- check_appointment: Consultar citas existentes (necesita número de teléfono)
+- escalate_to_human: Transferir a soporte humano (necesita motivo)
+
+Tu primera línea en la llamada ya fue: «{GREETING}»"""
+
+# Cached system blocks keyed by full prompt text. Every call shares the same
+# prompt (and usually the same KB), so agents reuse one block list instead of
+# each building its own.
+_SYSTEM_BLOCKS_CACHE: Dict[str, List[Dict]] = {}
+
 
 class AIAgent:
     """AI Agent powered by Claude with RAG and tool calling"""
 
+    __slots__ = (
+        "anthropic_api_key",
+        "client",
+        "model",
+        "knowledge_base",
+        "conversation_history",
+        "appointment_manager",
+        "escalation_handler",
+        "system_prompt",
+        "_cached_system",
+        "_warmup_task",
+        "_prefill_task",
+        "_prefill_key",
+        "_speculation",
+        "raw_stream",
+        "speculate",
+    )
+
     def __init__(self, knowledge_base: Optional[KnowledgeBase] = None):
         self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         if not self.anthropic_api_key:
             raise ValueError("ANTHROPIC_API_KEY not set")
 
         # Initialize Claude client
-        self.client = AsyncAnthropic(api_key=self.anthropic_api_key)
+        self.client = AsyncAnthropic(
+            api_key=self.anthropic_api_key,
+            http_client=_shared_http_client()
+        )
         self.model = "claude-haiku-4-5-20251001"
 
+        # Stream turns over raw SSE on the shared HTTP client instead of the
+        # SDK, skipping per-event model construction on the hot path
+        self.raw_stream = os.getenv("ANTHROPIC_RAW_STREAM", "").lower() in ("true", "1", "yes")
+
         # Knowledge base
         self.knowledge_base = knowledge_base
 
@@ -36,30 +417,20 @@ class AIAgent:
         self.conversation_history: List[Dict] = []
 
         # Tools
-        self.appointment_manager = AppointmentManager()
-        self.escalation_handler = EscalationHandler()
+        self.appointment_manager, self.escalation_handler = _shared_tool_backends()
 
         # System prompt optimized for voice conversations
-        self.system_prompt = """Eres Ana, recepcionista del Centro de Medicina Regenerativa (CMR), hablando en una llamada telefónica en vivo. SIEMPRE responde en español.
-
-REGLA MÁS IMPORTANTE: Sé BREVE. Máximo 1-2 oraciones por respuesta. Responde solo lo que se preguntó, sin información extra ni explicaciones largas. Si el paciente quiere más detalles, los pedirá.
-
-Tu estilo:
-- Clara, directa y amable — no demasiado formal ni robótica
-- Habla como una recepcionista real: natural, eficiente, con buenos modales
-- Habla de usted al paciente
-- Nunca uses markdown, viñetas ni formato — esto se lee en voz alta
-- Si no sabes algo, dilo y ofrece conectarlos con un doctor
-
-Herramientas disponibles:
-- book_appointment: Agendar citas (necesita fecha, hora, nombre, teléfono)
-- check_appointment: Consultar citas existentes (necesita número de teléfono)
-- escalate_to_human: Transferir a soporte humano (necesita motivo)"""
+        self.system_prompt = _BASE_SYSTEM_PROMPT
 
         # Embed entire knowledge base in system prompt to eliminate per-query
-        # RAG search latency (~876ms saved: OpenAI embedding + ChromaDB query)
+        # RAG search latency (~876ms saved: OpenAI embedding + ChromaDB query).
+        # Capped so a large KB doesn't inflate prefill on every turn
+        # (~4 chars per token; default budget is ~8000 tokens).
+        # The KB memoizes the rendered text per documents list and budget.
         if self.knowledge_base and hasattr(self.knowledge_base, 'get_all_documents_text'):
-            kb_text = self.knowledge_base.get_all_documents_text()
+            kb_text = self.knowledge_base.get_all_documents_text(
+                max_chars=int(os.getenv("KB_PROMPT_MAX_CHARS", "32000"))
+            )
             if kb_text:
                 self.system_prompt += kb_text
 
@@ -67,28 +438,180 @@ Herramientas disponibles:
         # The system prompt (including embedded KB) is identical across all turns in a
         # conversation. Caching it avoids re-processing ~500+ tokens on every request,
         # reducing TTFT by ~100-150ms on the 2nd+ message.
-        self._cached_system = [
-            {
-                "type": "text",
-                "text": self.system_prompt,
-                "cache_control": {"type": "ephemeral"}
-            }
-        ]
+        self._cached_system = _SYSTEM_BLOCKS_CACHE.get(self.system_prompt)
+        if self._cached_system is None:
+            self._cached_system = [
+                {
+                    "type": "text",
+                    "text": self.system_prompt,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ]
+            _SYSTEM_BLOCKS_CACHE[self.system_prompt] = self._cached_system
+        else:
+            # Drop this agent's freshly concatenated copy for the shared one
+            self.system_prompt = self._cached_system[0]["text"]
+
+        self._warmup_task: Optional[asyncio.Task] = None
+
+        # Speculative prefill while the caller is still speaking; keyed by
+        # history length so each user turn warms the cache at most once
+        self._prefill_task: Optional[asyncio.Task] = None
+        self._prefill_key = -1
+
+        # Speculative first reply stream started on a complete-looking
+        # interim transcript: (normalized text, history length, task, events).
+        # Opt-in: every distinct interim sentence opens a billed Claude stream.
+        self.speculate = os.getenv("SPECULATIVE_RESPONSES", "false").lower() in ("true", "1", "yes")
+        self._speculation: Optional[Tuple[str, int, asyncio.Task, asyncio.Queue]] = None
 
         logger.info("AIAgent initialized")
 
     async def send_greeting(self) -> str:
-        """Send initial greeting and add to conversation history"""
-        greeting = "Hola, ha llamado al Centro de Medicina Regenerativa. Habla con Ana, ¿cómo puedo ayudarle?"
-        logger.info(f"AI greeting: {greeting}")
+        """Return the opening line and warm the prompt cache for the call"""
+        global _cache_warm_task
 
-        # Add greeting to conversation history so Claude knows what was said
-        self.conversation_history.append({
-            "role": "assistant",
-            "content": greeting
-        })
+        # Warm the prompt cache while the greeting plays, so the caller's
+        # first turn reads the cached prefix instead of paying full prefill.
+        # Only a completed warmup counts: a failed or cancelled one (e.g. by
+        # cleanup() on a short call) leaves the next greeting to retry.
+        in_flight = _cache_warm_task is not None and not _cache_warm_task.done()
+        if not in_flight and time.monotonic() - _last_cache_warm > _CACHE_WARM_INTERVAL:
+            self._warmup_task = _cache_warm_task = asyncio.create_task(self.warm_prompt_cache())
+
+        logger.info("AI greeting: %s", GREETING)
+        return GREETING
+
+    async def warm_prompt_cache(self):
+        """
+        Write the tools + system prefix to Anthropic's prompt cache with a
+        1-token request. Tools are sent too, since they lead the cached prefix.
+        """
+        global _last_cache_warm
+        try:
+            await self.client.messages.create(
+                model=self.model,
+                max_tokens=1,
+                system=self._cached_system,
+                messages=[{"role": "user", "content": "."}],
+                tools=_TOOL_DEFINITIONS
+            )
+            _last_cache_warm = time.monotonic()
+            logger.info("Prompt cache warmed")
+        except Exception as e:
+            logger.warning("Prompt cache warmup failed: %s", e)
+
+    def prefill_partial(self, partial_text: str):
+        """
+        Speculatively prefill on an interim ASR transcript. Caches the
+        conversation prefix the final turn will share, so its prefill is
+        paid while the caller is still talking. Only the history before the
+        user turn is cacheable (the final text differs from any partial), so
+        one prefill per turn is enough and later partials are ignored.
+        """
+        key = len(self.conversation_history)
+        if key == 0 or key == self._prefill_key:
+            return
+        self._prefill_key = key
+
+        window = self._windowed_history(
+            self.conversation_history + [{"role": "user", "content": partial_text}]
+        )
+        if len(window) < 2:
+            return
+        messages = _with_cache_breakpoint(window, len(window) - 2)
+        self._prefill_task = asyncio.create_task(self._prefill(messages))
+
+    def on_partial_transcript(self, partial_text: str):
+        """Interim ASR hook: prefill the cached prefix and speculate on the reply"""
+        self.prefill_partial(partial_text)
+        if self.speculate:
+            self.speculate_partial(partial_text)
+
+    def speculate_partial(self, partial_text: str):
+        """
+        Open the turn's first Claude stream on an interim transcript that ends
+        like a finished sentence, buffering its events. process_message
+        replays them if the final transcript matches, so time-to-first-token
+        overlaps Deepgram's finalization. Nothing runs speculatively: tool
+        calls only execute once process_message consumes the events.
+        """
+        text = partial_text.strip()
+        if len(text) < _SPECULATION_MIN_CHARS or text[-1] not in ".?!" or fast_path_reply(text):
+            return
+        key = _normalize_utterance(text)
+        if self._speculation and self._speculation[0] == key:
+            return
+        self._cancel_speculation()
+
+        messages = self._turn_messages(self.conversation_history + [{"role": "user", "content": text}])
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self._buffer_stream(messages, events))
+        task.add_done_callback(functools.partial(self._end_buffer, events))
+        self._speculation = (key, len(self.conversation_history), task, events)
+
+    async def _buffer_stream(self, messages: List[Dict], events: asyncio.Queue):
+        """Read a reply stream into events; _end_buffer ends them"""
+        async with self._stream(**self._turn_params(messages)) as stream:
+            async for event in stream:
+                events.put_nowait(event)
+
+    @staticmethod
+    def _end_buffer(events: asyncio.Queue, task: asyncio.Task):
+        """
+        Done callback ending a speculation's events with None or the error,
+        however its task finished. Unlike a finally in _buffer_stream this
+        also runs for a task cancelled before it started, so a replay can
+        never wait forever.
+        """
+        if task.cancelled():
+            events.put_nowait(RuntimeError("Speculative response cancelled"))
+        else:
+            events.put_nowait(task.exception())
+
+    def _take_speculation(self, user_message: str) -> Optional[Tuple[asyncio.Task, asyncio.Queue]]:
+        """Claim the pending speculation if it answers user_message; cancel it otherwise"""
+        speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return None
+        key, history_len, task, events = speculation
+        if key == _normalize_utterance(user_message) and history_len == len(self.conversation_history):
+            return task, events
+        task.cancel()
+        return None
+
+    def _cancel_speculation(self):
+        if self._speculation:
+            self._speculation[2].cancel()
+            self._speculation = None
 
-        return greeting
+    @contextlib.asynccontextmanager
+    async def _replay_stream(self, task: asyncio.Task, events: asyncio.Queue):
+        """Stream the events buffered by a speculation, as _stream would"""
+        async def replay():
+            while (event := await events.get()) is not None:
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+
+        try:
+            yield replay()
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _prefill(self, messages: List[Dict]):
+        """Send a 1-token request that writes messages' cached prefix"""
+        try:
+            await self.client.messages.create(
+                model=self.model,
+                max_tokens=1,
+                system=self._cached_system,
+                messages=messages,
+                tools=_TOOL_DEFINITIONS
+            )
+        except Exception as e:
+            logger.debug("Speculative prefill failed: %s", e)
 
     async def process_message(self, user_message: str) -> AsyncIterator[Dict[str, Any]]:
         """
@@ -96,65 +619,131 @@ Herramientas disponibles:
         Yields chunks as they're generated (streaming).
         Handles tool calls with proper conversation history management.
         """
+        tool_tasks: List[asyncio.Task] = []
+        embed_task: Optional[asyncio.Task] = None
+        # A claimed speculation is either replayed (the replay owns its task)
+        # or cancelled on the way out, whichever branch the turn takes
+        speculation = None
+        replayed = False
         try:
+            speculation = self._take_speculation(user_message)
+            cache_key = self._response_cache_key(user_message)
+
             # Add user message to history
             self.conversation_history.append({
                 "role": "user",
                 "content": user_message
             })
 
-            # KB is embedded in system prompt - no per-query search needed
-            messages = self.conversation_history.copy()
+            fast_reply = fast_path_reply(user_message)
+            if fast_reply:
+                yield self._local_reply(fast_reply, "fast path")
+                return
 
-            # Define tools for Claude
-            tools = self._get_tool_definitions()
+            cached = _cached_reply(cache_key) if cache_key else None
+            if cached:
+                yield self._local_reply(cached, "cached")
+                return
+
+            # Embed the utterance while Claude's stream opens, to look for a
+            # differently worded repeat without delaying a miss
+            if (cache_key and RESPONSE_CACHE_SIMILARITY is not None
+                    and self.knowledge_base is not None and self.knowledge_base.openai_client):
+                embed_task = asyncio.create_task(self.knowledge_base.embed_query(user_message))
+
+            # KB is embedded in system prompt - no per-query search needed.
+            messages = self._turn_messages(self.conversation_history)
 
             # Stream response from Claude
             response_text = ""
+            text_chunks = _TextCoalescer()
             tool_calls = []
-            tool_input_json_buffer = ""
+            tool_input_json_parts: List[str] = []
+            in_tool_block = False
+            stop_reason = None
 
-            async with self.client.messages.stream(
-                model=self.model,
-                max_tokens=100,
-                temperature=0.3,
-                system=self._cached_system,
-                messages=messages,
-                tools=tools
-            ) as stream:
-                async for event in stream:
-                    if event.type == "content_block_start":
-                        if hasattr(event.content_block, "type") and event.content_block.type == "tool_use":
-                            tool_calls.append({
-                                "id": event.content_block.id,
-                                "name": event.content_block.name,
-                                "input": {}
-                            })
-                            tool_input_json_buffer = ""
-
-                    elif event.type == "content_block_delta":
-                        if hasattr(event.delta, "text"):
-                            # Text content from Claude
-                            chunk_text = event.delta.text
-                            response_text += chunk_text
-                            yield {
-                                "type": "text",
-                                "content": chunk_text
-                            }
-                        elif hasattr(event.delta, "partial_json"):
-                            # Accumulate tool input JSON fragments
-                            # Do NOT parse each fragment individually
-                            tool_input_json_buffer += event.delta.partial_json or ""
-
-                    elif event.type == "content_block_stop":
-                        # Parse accumulated JSON when tool_use block closes
-                        if tool_calls and tool_input_json_buffer:
-                            try:
-                                tool_calls[-1]["input"] = json.loads(tool_input_json_buffer)
-                            except json.JSONDecodeError as e:
-                                logger.error(f"Failed to parse tool input JSON: {e}")
-                                tool_calls[-1]["input"] = {}
-                            tool_input_json_buffer = ""
+            # Replay the speculative stream when the caller said what it assumed
+            if speculation:
+                first_stream = self._replay_stream(*speculation)
+                replayed = True
+            else:
+                first_stream = self._stream(**self._turn_params(messages))
+
+            async with first_stream as stream:
+                # The stream takes about as long to open as the embedding
+                similar_reply = self._similar_cached_reply(embed_task, cache_key)
+                if similar_reply is None:
+                    async for event in stream:
+                        if event.type == "content_block_start":
+                            if event.content_block.type == "tool_use":
+                                # Speak any text that preceded the tool call first
+                                pending_text = text_chunks.flush()
+                                if pending_text:
+                                    yield {
+                                        "type": "text",
+                                        "content": pending_text
+                                    }
+                                tool_calls.append({
+                                    "id": event.content_block.id,
+                                    "name": event.content_block.name,
+                                    "input": {}
+                                })
+                                tool_input_json_parts = []
+                                in_tool_block = True
+
+                        elif event.type == "content_block_delta":
+                            # Dispatch on the delta's type discriminant instead of
+                            # probing for attributes on every token
+                            delta = event.delta
+                            if delta.type == "text_delta":
+                                # Text content from Claude, yielded in phrase-sized chunks
+                                response_text += delta.text
+                                chunk_text = text_chunks.push(delta.text)
+                                if chunk_text:
+                                    yield {
+                                        "type": "text",
+                                        "content": chunk_text
+                                    }
+                            elif delta.type == "input_json_delta":
+                                # Collect tool input JSON fragments and join once at
+                                # block stop (no quadratic str +=, no per-fragment parse)
+                                if delta.partial_json:
+                                    tool_input_json_parts.append(delta.partial_json)
+
+                        elif event.type == "message_delta":
+                            stop_reason = event.delta.stop_reason
+
+                        elif event.type == "content_block_stop" and in_tool_block:
+                            # Parse accumulated JSON when tool_use block closes
+                            tool_call = tool_calls[-1]
+                            if tool_input_json_parts:
+                                try:
+                                    tool_call["input"] = orjson.loads("".join(tool_input_json_parts))
+                                except orjson.JSONDecodeError as e:
+                                    logger.error("Failed to parse tool input JSON: %s", e)
+                                    tool_call["input"] = {}
+                                tool_input_json_parts = []
+                            in_tool_block = False
+
+                            # Start the tool as soon as its arguments are complete
+                            # so its I/O overlaps the rest of Claude's stream;
+                            # _execute_tool turns failures into {"error": ...}
+                            # results so one tool can't cancel the rest
+                            logger.info("Executing tool: %s with input: %s", tool_call["name"], tool_call["input"])
+                            tool_tasks.append(asyncio.create_task(
+                                self._execute_tool(tool_call["name"], tool_call["input"])
+                            ))
+
+            if similar_reply is not None:
+                yield self._local_reply(similar_reply, "similar cached")
+                return
+
+            pending_text = text_chunks.flush()
+            if pending_text:
+                yield {
+                    "type": "text",
+                    "content": pending_text
+                }
 
             # Handle tool calls with proper history management
             if tool_calls:
@@ -178,27 +767,30 @@ Herramientas disponibles:
                     "content": assistant_content
                 })
 
-                # Execute all tools and collect results
-                tool_results_content = []
-                for tool_call in tool_calls:
-                    tool_name = tool_call["name"]
-                    tool_input = tool_call["input"]
-
-                    logger.info(f"Executing tool: {tool_name} with input: {tool_input}")
-                    tool_result = await self._execute_tool(tool_name, tool_input)
-
-                    yield {
-                        "type": "tool_call",
-                        "name": tool_name,
-                        "input": tool_input,
-                        "result": tool_result
-                    }
+                # Tools were started as their blocks closed and run
+                # concurrently; report each one as soon as it finishes
+                pending = set(tool_tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for tool_call, task in zip(tool_calls, tool_tasks):
+                        if task in done:
+                            yield {
+                                "type": "tool_call",
+                                "name": tool_call["name"],
+                                "input": tool_call["input"],
+                                "result": task.result()
+                            }
 
-                    tool_results_content.append({
+                # Results go back to Claude in tool_use order
+                tool_results = [task.result() for task in tool_tasks]
+                tool_results_content = [
+                    {
                         "type": "tool_result",
                         "tool_use_id": tool_call["id"],
-                        "content": json.dumps(tool_result)
-                    })
+                        "content": orjson.dumps(tool_result).decode()
+                    }
+                    for tool_call, tool_result in zip(tool_calls, tool_results)
+                ]
 
                 # Add all tool results as a single user message
                 self.conversation_history.append({
@@ -206,24 +798,45 @@ Herramientas disponibles:
                     "content": tool_results_content
                 })
 
-                # Generate follow-up response after tool execution
-                async with self.client.messages.stream(
-                    model=self.model,
-                    max_tokens=100,
-                    temperature=0.3,
-                    system=self._cached_system,
-                    messages=self.conversation_history
-                ) as follow_up_stream:
-                    follow_up_text = ""
-                    async for event in follow_up_stream:
-                        if event.type == "content_block_delta":
-                            if hasattr(event.delta, "text"):
-                                chunk = event.delta.text
-                                follow_up_text += chunk
-                                yield {
-                                    "type": "text",
-                                    "content": chunk
-                                }
+                # Deterministic tools' results can be spoken as they are.
+                # When one of them is the only call and Claude said nothing
+                # yet, speak that instead of making a second Claude call.
+                follow_up_text = ""
+                direct_message = None
+                if (len(tool_calls) == 1 and not response_text.strip()
+                        and tool_calls[0]["name"] in _DIRECT_RESPONSE_TOOLS):
+                    direct_message = _spoken_tool_reply(tool_calls[0]["name"], tool_results[0])
+
+                if direct_message:
+                    follow_up_text = direct_message
+                    yield {
+                        "type": "text",
+                        "content": direct_message
+                    }
+                else:
+                    # Generate follow-up response after tool execution.
+                    # Send the same tools as the first call: tools precede the
+                    # system prompt in the cached prefix, so omitting them here
+                    # would miss the prompt cache the first call just wrote.
+                    async with self._stream(
+                        **self._turn_params(self._windowed_history())
+                    ) as follow_up_stream:
+                        async for event in follow_up_stream:
+                            if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                                follow_up_text += event.delta.text
+                                chunk_text = text_chunks.push(event.delta.text)
+                                if chunk_text:
+                                    yield {
+                                        "type": "text",
+                                        "content": chunk_text
+                                    }
+
+                    pending_text = text_chunks.flush()
+                    if pending_text:
+                        yield {
+                            "type": "text",
+                            "content": pending_text
+                        }
 
                 # Add follow-up to history
                 if follow_up_text:
@@ -231,7 +844,7 @@ Herramientas disponibles:
                         "role": "assistant",
                         "content": follow_up_text
                     })
-                    logger.info(f"AI (after tool): {follow_up_text}")
+                    logger.info("AI (after tool): %s", follow_up_text)
 
             else:
                 # No tool calls - simple text response
@@ -240,77 +853,157 @@ Herramientas disponibles:
                         "role": "assistant",
                         "content": response_text
                     })
-                    logger.info(f"AI: {response_text}")
+                    logger.info("AI: %s", response_text)
+
+                    # Only complete, tool-free replies are cached: a tool call
+                    # has side effects and its result depends on state outside
+                    # the key, and a max_tokens reply was cut off mid-sentence
+                    if cache_key and stop_reason != "max_tokens":
+                        _response_cache[cache_key] = (
+                            response_text, _task_result(embed_task),
+                            time.monotonic() + RESPONSE_CACHE_TTL,
+                        )
+                        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                            _response_cache.popitem(last=False)
 
         except Exception as e:
-            logger.error(f"Error processing message: {e}", exc_info=True)
+            logger.error("Error processing message: %s", e, exc_info=True)
             yield {
                 "type": "error",
                 "content": "Lo siento, estoy teniendo problemas para procesar eso. ¿Podrías repetirlo por favor?"
             }
+        finally:
+            # Don't leave tools running if the stream failed or the caller
+            # stopped consuming (barge-in)
+            for task in tool_tasks:
+                if not task.done():
+                    task.cancel()
+            if embed_task and not embed_task.done():
+                embed_task.cancel()
+            if speculation and not replayed:
+                speculation[0].cancel()
+
+    def _local_reply(self, reply: str, source: str) -> Dict[str, Any]:
+        """Record a reply produced without Claude and return its text chunk"""
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": reply
+        })
+        logger.info("AI (%s): %s", source, reply)
+        return {
+            "type": "text",
+            "content": reply
+        }
+
+    def _similar_cached_reply(self, embed_task: Optional[asyncio.Task],
+                              cache_key: Optional[Tuple[str, int]]) -> Optional[str]:
+        """Cached reply for the closest utterance in the same context that
+        names the same numbers, dates and weekdays, if the embedding is ready
+        and within RESPONSE_CACHE_SIMILARITY"""
+        query_vec = _task_result(embed_task)
+        if query_vec is None:
+            return None
+        now = time.monotonic()
+        anchors = _anchor_words(cache_key[0])
+        entries = [(key, vec) for key, (_, vec, expires) in _response_cache.items()
+                   if key[1] == cache_key[1] and vec is not None and expires > now
+                   and _anchor_words(key[0]) == anchors]
+        if not entries:
+            return None
+
+        similarities = np.stack([vec for _, vec in entries]) @ query_vec
+        best = int(np.argmax(similarities))
+        if similarities[best] < RESPONSE_CACHE_SIMILARITY:
+            return None
+
+        key = entries[best][0]
+        _response_cache.move_to_end(key)
+        return _response_cache[key][0]
+
+    def _response_cache_key(self, user_message: str) -> Optional[Tuple[str, int]]:
+        """
+        Key for the reply cache: the normalized utterance plus a hash of what
+        Claude would see before it (system prompt and windowed history).
+        Call before user_message is appended to the history.
+        """
+        if not RESPONSE_CACHE_SIZE:
+            return None
+        utterance = _normalize_utterance(user_message)
+        if not utterance:
+            return None
+        context = hash((self.system_prompt, orjson.dumps(self._windowed_history())))
+        return utterance, context
+
+    def _turn_messages(self, history: List[Dict]) -> List[Dict]:
+        """
+        Windowed messages for a turn ending in a new user message. The
+        breakpoint before that message reads the history prefix cached by
+        prefill_partial while the caller was speaking.
+        """
+        messages = self._windowed_history(history)
+        if len(messages) >= 2:
+            messages = _with_cache_breakpoint(messages, len(messages) - 2)
+        return messages
+
+    def _turn_params(self, messages: List[Dict]) -> Dict[str, Any]:
+        """Messages API parameters for a reply stream"""
+        return {
+            "model": self.model,
+            "max_tokens": 100,
+            "temperature": 0.3,
+            "system": self._cached_system,
+            "messages": messages,
+            "tools": _TOOL_DEFINITIONS,
+        }
+
+    def _stream(self, **params):
+        """Open a streaming Messages request via raw SSE or the SDK"""
+        if self.raw_stream:
+            return self._raw_stream(**params)
+        return self.client.messages.stream(**params)
+
+    @contextlib.asynccontextmanager
+    async def _raw_stream(self, **params):
+        """Stream a Messages request as parsed SSE events, without the SDK"""
+        base_url = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+        async with _shared_http_client().stream(
+            "POST",
+            f"{base_url}/v1/messages",
+            headers={
+                "x-api-key": self.anthropic_api_key,
+                "anthropic-version": "2023-06-01",
+                "content-type": "application/json"
+            },
+            content=orjson.dumps({**params, "stream": True})
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise RuntimeError(f"Anthropic API error {response.status_code}: {body[:200]!r}")
+            yield _sse_events(response)
+
+    def _windowed_history(self, history: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Return the last MAX_HISTORY_MESSAGES messages of the conversation
+        (or of the given history). The window always opens on a plain user
+        message, so a tool_use block is never separated from its tool_result.
+        """
+        if history is None:
+            history = self.conversation_history
+        if len(history) <= MAX_HISTORY_MESSAGES:
+            # The SDK serializes messages when the request is sent and never
+            # mutates them, so the live list can be passed without a copy
+            return history
+
+        start = len(history) - MAX_HISTORY_MESSAGES
+        while start < len(history) - 1 and not (
+            history[start]["role"] == "user" and isinstance(history[start]["content"], str)
+        ):
+            start += 1
+        return history[start:]
 
     def _get_tool_definitions(self) -> List[Dict]:
         """Return tool definitions for Claude API"""
-        return [
-            {
-                "name": "book_appointment",
-                "description": "Book an appointment for a customer. Requires date, time, customer name, and phone number.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "date": {
-                            "type": "string",
-                            "description": "Appointment date in YYYY-MM-DD format"
-                        },
-                        "time": {
-                            "type": "string",
-                            "description": "Appointment time in HH:MM format (24-hour)"
-                        },
-                        "name": {
-                            "type": "string",
-                            "description": "Customer name"
-                        },
-                        "phone": {
-                            "type": "string",
-                            "description": "Customer phone number"
-                        }
-                    },
-                    "required": ["date", "time", "name", "phone"]
-                }
-            },
-            {
-                "name": "check_appointment",
-                "description": "Check appointment status for a customer by phone number.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "phone": {
-                            "type": "string",
-                            "description": "Customer phone number"
-                        }
-                    },
-                    "required": ["phone"]
-                }
-            },
-            {
-                "name": "escalate_to_human",
-                "description": "Escalate the call to a human support agent. Use when the customer needs help beyond your capabilities.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "reason": {
-                            "type": "string",
-                            "description": "Reason for escalation"
-                        },
-                        "callback_number": {
-                            "type": "string",
-                            "description": "Customer callback number"
-                        }
-                    },
-                    "required": ["reason"]
-                }
-            }
-        ]
+        return list(_TOOL_DEFINITIONS)
 
     async def _execute_tool(self, tool_name: str, tool_input: Dict) -> Dict:
         """Execute a tool and return the result"""
@@ -328,9 +1021,13 @@ Herramientas disponibles:
                 return {"error": f"Unknown tool: {tool_name}"}
 
         except Exception as e:
-            logger.error(f"Tool execution error: {e}", exc_info=True)
+            logger.error("Tool execution error: %s", e, exc_info=True)
             return {"error": str(e)}
 
     async def cleanup(self):
         """Clean up resources"""
+        for task in (self._warmup_task, self._prefill_task):
+            if task and not task.done():
+                task.cancel()
+        self._cancel_speculation()
         logger.info("AIAgent cleaned up")
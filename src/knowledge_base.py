@@ -3,16 +3,45 @@ Knowledge Base - RAG implementation with ChromaDB
 Vector search for relevant document retrieval
 """
 
+import asyncio
+import hashlib
 import os
-import json
 import logging
-from typing import List, Dict, Optional
+import re
+import sqlite3
+from collections import OrderedDict, defaultdict
+from typing import List, Dict, Optional, Tuple
 
 import chromadb
+import numpy as np
+import orjson
 from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
+# Inputs per OpenAI embeddings request when embedding the KB in bulk
+EMBEDDING_BATCH_SIZE = 96
+# Embedding requests in flight at once, to stay within OpenAI rate limits
+EMBEDDING_MAX_CONCURRENCY = 8
+# Rows per ChromaDB add() call; keeps each SQLite transaction moderate
+CHROMA_ADD_BATCH_SIZE = 128
+
+# SQLite host parameter limit is 999 on older builds
+_CACHE_LOOKUP_CHUNK = 900
+
+# Recent search results reused for repeated or near-identical questions
+QUERY_CACHE_SIZE = 256
+QUERY_CACHE_SIMILARITY = 0.97
+
+# Words used for keyword search in inline mode; short words are mostly
+# articles and prepositions ("de", "la", "en") and carry no signal
+_WORD_RE = re.compile(r"\w{3,}")
+
+
+def _terms(text: str) -> frozenset:
+    """Lowercased keyword set of a text"""
+    return frozenset(_WORD_RE.findall(text.lower()))
+
 
 def _is_placeholder(value: str) -> bool:
     """Detect placeholder API key values from .env.example"""
@@ -34,16 +63,39 @@ class KnowledgeBase:
             self.openai_client = AsyncOpenAI(api_key=self.openai_api_key)
         self.embedding_model = "text-embedding-3-small"
 
+        # KB_MODE=inline: the agent embeds the whole KB in its system prompt,
+        # so skip ChromaDB and embeddings entirely; search() falls back to
+        # in-process keyword matching
+        self.mode = "inline" if os.getenv("KB_MODE", "vector").lower() == "inline" else "vector"
+        self._doc_terms: List[frozenset] = []
+
         # Initialize ChromaDB with persistent storage
-        chroma_path = "./data/chroma"
-        os.makedirs(chroma_path, exist_ok=True)
-        self.chroma_client = chromadb.PersistentClient(path=chroma_path)
+        self.chroma_client = None
+        if self.mode == "vector":
+            chroma_path = "./data/chroma"
+            os.makedirs(chroma_path, exist_ok=True)
+            self.chroma_client = chromadb.PersistentClient(path=chroma_path)
+
+        # Embeddings of unchanged documents survive collection rebuilds
+        self.embedding_cache_path = "./data/embedding_cache.sqlite"
 
         self.collection_name = "voice_agent_kb"
         self.collection = None
         self.document_count = 0
         self.documents = []
 
+        # Documents grouped by category and formatted KB text per max_chars,
+        # both valid for _docs_text_source
+        self._by_category: Dict[str, List[Dict]] = {}
+        self._docs_text_cache: Dict[Optional[int], str] = {}
+        self._docs_text_source: Optional[List[Dict]] = None
+
+        # Throwaway embedding request that opens the OpenAI connection early
+        self._warmup_task: Optional[asyncio.Task] = None
+
+        # LRU of normalized query -> (unit query vector or None, top_k, results)
+        self._query_cache: "OrderedDict[str, Tuple[Optional[np.ndarray], int, List[Dict]]]" = OrderedDict()
+
         logger.info("KnowledgeBase initialized")
 
     async def initialize(self, kb_path: str):
@@ -53,9 +105,9 @@ class KnowledgeBase:
         try:
             logger.info(f"Loading knowledge base from: {kb_path}")
 
-            # Load documents
-            with open(kb_path, 'r') as f:
-                data = json.load(f)
+            # Load documents; orjson parses straight from the raw bytes
+            with open(kb_path, 'rb') as f:
+                data = orjson.loads(f.read())
 
             documents = data.get("documents", [])
             if not documents:
@@ -63,17 +115,33 @@ class KnowledgeBase:
 
             self.document_count = len(documents)
             self.documents = documents
+            self._group_documents()
+            self._query_cache.clear()
             logger.info(f"Loaded {self.document_count} documents")
 
-            # Get or create collection
-            self.collection = self.chroma_client.get_or_create_collection(
+            if self.mode == "inline":
+                self._doc_terms = [
+                    _terms(f"{doc.get('question', '')} {doc.get('answer', '')}") for doc in documents
+                ]
+                logger.info("KB_MODE=inline - skipping embeddings and vector index")
+                return
+
+            # Open the OpenAI connection (TCP + TLS) while ChromaDB loads, so
+            # the first caller's query doesn't pay for the handshake
+            if self.openai_client and self._warmup_task is None:
+                self._warmup_task = asyncio.create_task(self._warm_up_openai())
+
+            # Get or create collection. ChromaDB calls are synchronous
+            # (SQLite/HNSW), so they run in a worker thread throughout
+            self.collection = await asyncio.to_thread(
+                self.chroma_client.get_or_create_collection,
                 name=self.collection_name,
                 metadata={"description": "Voice agent knowledge base"}
             )
             logger.info(f"Using collection: {self.collection_name}")
 
             # Check if collection already has documents
-            existing_count = self.collection.count()
+            existing_count = await asyncio.to_thread(self.collection.count)
             if existing_count > 0:
                 logger.info(f"Collection already has {existing_count} documents - skipping embedding")
                 return
@@ -84,7 +152,7 @@ class KnowledgeBase:
             ids = []
             texts = []
             metadatas = []
-            embeddings_list = []
+            embeddings = None
 
             for doc in documents:
                 doc_id = doc.get("id", f"doc_{len(ids)}")
@@ -100,26 +168,22 @@ class KnowledgeBase:
                     "answer": doc.get("answer", "")
                 })
 
-                # Generate embedding
-                if self.openai_client:
-                    embedding = await self._generate_embedding(text)
-                    embeddings_list.append(embedding)
-
-            # Add to collection
-            if embeddings_list:
-                self.collection.add(
-                    ids=ids,
-                    documents=texts,
-                    metadatas=metadatas,
-                    embeddings=embeddings_list
-                )
-            else:
-                # Fallback: use ChromaDB's default embedding function
-                self.collection.add(
-                    ids=ids,
-                    documents=texts,
-                    metadatas=metadatas
-                )
+            # Embed all documents in batched requests instead of one per doc
+            if self.openai_client:
+                embeddings = await self._generate_embeddings(texts)
+
+            # Add to collection in batches, off the event loop. Without
+            # embeddings ChromaDB falls back to its default embedding function
+            for i in range(0, len(ids), CHROMA_ADD_BATCH_SIZE):
+                batch = slice(i, i + CHROMA_ADD_BATCH_SIZE)
+                add_kwargs = {
+                    "ids": ids[batch],
+                    "documents": texts[batch],
+                    "metadatas": metadatas[batch]
+                }
+                if embeddings is not None:
+                    add_kwargs["embeddings"] = embeddings[batch]
+                await asyncio.to_thread(self.collection.add, **add_kwargs)
 
             logger.info(f"Knowledge base initialized with {len(documents)} documents")
 
@@ -127,42 +191,203 @@ class KnowledgeBase:
             logger.error(f"Failed to initialize knowledge base: {e}", exc_info=True)
             raise
 
-    async def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding using OpenAI"""
+    async def _warm_up_openai(self):
+        """Send a tiny embedding request to establish the pooled connection"""
+        try:
+            await self.openai_client.embeddings.create(model=self.embedding_model, input="warmup")
+            logger.info("OpenAI connection warmed up")
+        except Exception as e:
+            logger.warning(f"OpenAI warmup failed: {e}")
+
+    async def _generate_embedding(self, text: str) -> np.ndarray:
+        """Generate embedding using OpenAI, as a contiguous float32 vector"""
         try:
             response = await self.openai_client.embeddings.create(
                 model=self.embedding_model,
                 input=text
             )
-            return response.data[0].embedding
+            return np.asarray(response.data[0].embedding, dtype=np.float32)
 
+        except Exception as e:
+            logger.error("Embedding error: %s", e)
+            raise
+
+    async def embed_query(self, text: str) -> Optional[np.ndarray]:
+        """Unit-length embedding of text, or None without OpenAI or on failure"""
+        if not self.openai_client:
+            return None
+        try:
+            embedding = await self._generate_embedding(text)
+        except Exception:
+            return None
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    async def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings for many texts, EMBEDDING_BATCH_SIZE inputs per
+        OpenAI request, with up to EMBEDDING_MAX_CONCURRENCY batches in flight.
+        Returns a float32 matrix with one row per text, in input order.
+        """
+        keys = [self._embedding_cache_key(text) for text in texts]
+        cached = await asyncio.to_thread(self._load_cached_embeddings, keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if not missing:
+            logger.info(f"All {len(texts)} embeddings loaded from cache")
+            return np.vstack([cached[key] for key in keys])
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+
+        semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+
+        async def embed_batch(batch: List[str]) -> List[np.ndarray]:
+            async with semaphore:
+                response = await self.openai_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=batch
+                )
+            # The API tags each vector with its input index
+            return [np.asarray(d.embedding, dtype=np.float32)
+                    for d in sorted(response.data, key=lambda d: d.index)]
+
+        try:
+            missing_texts = [texts[i] for i in missing]
+            batches = await asyncio.gather(*(
+                embed_batch(missing_texts[i:i + EMBEDDING_BATCH_SIZE])
+                for i in range(0, len(missing_texts), EMBEDDING_BATCH_SIZE)
+            ))
         except Exception as e:
             logger.error(f"Embedding error: {e}")
             raise
 
-    def get_all_documents_text(self) -> str:
+        fresh = {keys[i]: embedding for i, embedding in zip(missing, (e for b in batches for e in b))}
+        await asyncio.to_thread(self._store_cached_embeddings, fresh)
+        cached.update(fresh)
+        return np.vstack([cached[key] for key in keys])
+
+    def _embedding_cache_key(self, text: str) -> str:
+        """Cache key for an embedding: sha256 of model and text"""
+        return hashlib.sha256(f"{self.embedding_model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _open_embedding_cache(self) -> sqlite3.Connection:
+        """Open the embedding cache, creating its table if needed"""
+        conn = sqlite3.connect(self.embedding_cache_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, model TEXT, vec BLOB)"
+        )
+        return conn
+
+    def _load_cached_embeddings(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return cached embeddings for the given keys; failures are cache misses"""
+        found = {}
+        try:
+            conn = self._open_embedding_cache()
+            try:
+                for i in range(0, len(keys), _CACHE_LOOKUP_CHUNK):
+                    chunk = keys[i:i + _CACHE_LOOKUP_CHUNK]
+                    rows = conn.execute(
+                        f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    for key, vec in rows:
+                        found[key] = np.frombuffer(vec, dtype=np.float32)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+        return found
+
+    def _store_cached_embeddings(self, embeddings: Dict[str, np.ndarray]):
+        """Write embeddings to the cache as float32 blobs"""
+        if not embeddings:
+            return
+        try:
+            conn = self._open_embedding_cache()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (hash, model, vec) VALUES (?, ?, ?)",
+                        [
+                            (key, self.embedding_model, vec.tobytes())
+                            for key, vec in embeddings.items()
+                        ]
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def get_all_documents_text(self, max_chars: Optional[int] = None) -> str:
         """
         Return all KB documents as formatted text for embedding in the system prompt.
         This eliminates the need for per-query embedding + vector search (~876ms saved).
+
+        Documents are grouped by category, categories in alphabetical order and
+        documents in file order within each. If max_chars is set, a document
+        that doesn't fit the remaining budget is skipped, while smaller ones
+        after it are still included, so a large KB can't bloat the prefill
+        of every request.
+
+        The text is built once per documents list and budget, then reused by
+        every agent created afterwards.
         """
-        if not self.documents:
-            return ""
+        if self.documents is not self._docs_text_source:
+            self._group_documents()
 
-        categories = {}
+        text = self._docs_text_cache.get(max_chars)
+        if text is None:
+            text = self._docs_text_cache[max_chars] = self._format_all_documents(max_chars)
+        return text
+
+    def _group_documents(self):
+        """Group the current documents by category and drop stale formatted text"""
+        by_category: Dict[str, List[Dict]] = defaultdict(list)
         for doc in self.documents:
-            cat = doc.get("category", "general")
-            if cat not in categories:
-                categories[cat] = []
-            categories[cat].append(doc)
+            by_category[doc.get("category", "general")].append(doc)
+        self._by_category = dict(by_category)
+        self._docs_text_source = self.documents
+        self._docs_text_cache = {}
+
+    def _format_all_documents(self, max_chars: Optional[int]) -> str:
+        """Format documents grouped by category, within the max_chars budget"""
+        if not self.documents:
+            return ""
 
-        lines = ["\n\nBase de Conocimientos de la Empresa (usa esto para responder preguntas de los clientes):"]
-        for cat in sorted(categories.keys()):
-            lines.append(f"\n[{cat.upper()}]")
-            for doc in categories[cat]:
-                lines.append(f"Q: {doc.get('question', '')}")
-                lines.append(f"A: {doc.get('answer', '')}")
+        header = "\n\nBase de Conocimientos de la Empresa (usa esto para responder preguntas de los clientes):"
+        used = len(header)
+        categories: Dict[str, List[str]] = {}
+        included = 0
+        for cat in sorted(self._by_category):
+            lines: List[str] = []
+            # "[CATEGORY]" line plus its leading blank line and newline
+            header_cost = len(cat) + 4
+            for doc in self._by_category[cat]:
+                question = f"Q: {doc.get('question', '')}"
+                answer = f"A: {doc.get('answer', '')}"
+
+                # Each line costs its length plus the joining newline
+                cost = len(question) + len(answer) + 2
+                if not lines:
+                    cost += header_cost
+                if max_chars is not None and used + cost > max_chars:
+                    continue
+                used += cost
+
+                lines.append(question)
+                lines.append(answer)
+                included += 1
+            if lines:
+                categories[cat] = lines
+
+        if included < len(self.documents):
+            logger.warning(
+                f"KB text capped at {max_chars} chars: embedding {included} of "
+                f"{len(self.documents)} documents in the system prompt"
+            )
 
-        return "\n".join(lines)
+        return "\n".join([header] + [
+            line
+            for cat in sorted(categories)
+            for line in (f"\n[{cat.upper()}]", *categories[cat])
+        ])
 
     async def search(self, query: str, top_k: int = 3) -> List[Dict]:
         """
@@ -170,24 +395,44 @@ class KnowledgeBase:
         Returns list of matching documents with metadata
         """
         try:
+            if self.mode == "inline":
+                return self._keyword_search(query, top_k)
+
             if not self.collection:
                 logger.warning("Collection not initialized")
                 return []
 
+            # Exact repeat of a recent question
+            cache_key = " ".join(query.lower().split())
+            cached = self._query_cache.get(cache_key)
+            if cached and cached[1] == top_k:
+                self._query_cache.move_to_end(cache_key)
+                return cached[2]
+
             # Generate query embedding
             query_embedding = None
+            query_vec = None
             if self.openai_client:
                 query_embedding = await self._generate_embedding(query)
+                query_vec = query_embedding / (np.linalg.norm(query_embedding) or 1.0)
+
+                # Near-identical recent question: one matrix-vector product
+                # over the cached unit vectors instead of a Chroma query
+                hit = self._similar_cached_query(query_vec, top_k)
+                if hit is not None:
+                    return hit
 
             # Search collection
-            if query_embedding:
-                results = self.collection.query(
+            if query_embedding is not None:
+                results = await asyncio.to_thread(
+                    self.collection.query,
                     query_embeddings=[query_embedding],
                     n_results=top_k
                 )
             else:
                 # Fallback: use text search
-                results = self.collection.query(
+                results = await asyncio.to_thread(
+                    self.collection.query,
                     query_texts=[query],
                     n_results=top_k
                 )
@@ -204,9 +449,54 @@ class KnowledgeBase:
                         "distance": results["distances"][0][i] if "distances" in results else 0
                     })
 
-            logger.info(f"Found {len(documents)} relevant documents for: {query[:50]}...")
+            logger.info("Found %s relevant documents for: %s...", len(documents), query[:50])
+
+            self._query_cache[cache_key] = (query_vec, top_k, documents)
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
             return documents
 
         except Exception as e:
-            logger.error(f"Search error: {e}", exc_info=True)
+            logger.error("Search error: %s", e, exc_info=True)
             return []
+
+    def _similar_cached_query(self, query_vec: np.ndarray, top_k: int) -> Optional[List[Dict]]:
+        """Return cached results of a recent query within QUERY_CACHE_SIMILARITY, if any"""
+        entries = [(key, vec) for key, (vec, k, _) in self._query_cache.items()
+                   if vec is not None and k == top_k]
+        if not entries:
+            return None
+
+        similarities = np.stack([vec for _, vec in entries]) @ query_vec
+        best = int(np.argmax(similarities))
+        if similarities[best] < QUERY_CACHE_SIMILARITY:
+            return None
+
+        key = entries[best][0]
+        self._query_cache.move_to_end(key)
+        return self._query_cache[key][2]
+
+    def _keyword_search(self, query: str, top_k: int) -> List[Dict]:
+        """Rank documents by keywords shared with the query (inline mode)"""
+        query_terms = _terms(query)
+        if not query_terms:
+            return []
+
+        scored = []
+        for i, doc_terms in enumerate(self._doc_terms):
+            overlap = len(query_terms & doc_terms)
+            if overlap:
+                scored.append((overlap, i))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+
+        documents = []
+        for overlap, i in scored[:top_k]:
+            doc = self.documents[i]
+            documents.append({
+                "id": doc.get("id", f"doc_{i}"),
+                "category": doc.get("category", "general"),
+                "question": doc.get("question", ""),
+                "answer": doc.get("answer", ""),
+                "distance": 1.0 - overlap / len(query_terms)
+            })
+        return documents
@@ -4,25 +4,46 @@ Handles Twilio voice calls with WebSocket streaming
 """
 
 import asyncio
-import base64
-import json
+import binascii
+import contextlib
 import logging
 import os
+import re
 import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, List, Optional
 
+import numpy as np
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response
 import uvicorn
 from dotenv import load_dotenv
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, GCCollector, Gauge, PlatformCollector, ProcessCollector,
+    generate_latest, multiprocess, values,
+)
 
 from websockets.exceptions import ConnectionClosedError as WsClosedError
 from voice_handler import VoiceHandler
-from ai_agent import AIAgent
+from ai_agent import AIAgent, FAST_PATH_REPLIES, GREETING, fast_path_reply
 from knowledge_base import KnowledgeBase
 from tools import AppointmentManager, EscalationHandler
 
+# Base64 for Twilio media payloads (~50 frames/s each way per call).
+# pybase64 uses SIMD codecs when installed; binascii is the fallback.
+try:
+    import pybase64
+
+    _b64encode = pybase64.b64encode_as_string
+    _b64decode = pybase64.b64decode
+except ImportError:
+    def _b64encode(data: bytes) -> str:
+        return binascii.b2a_base64(data, newline=False).decode("ascii")
+
+    _b64decode = binascii.a2b_base64
+
 # ---------------------------------------------------------------------------
 # Voice Activity Detection (VAD) for instant interrupt detection.
 # Decodes mu-law audio and checks RMS energy — runs on raw Twilio frames,
@@ -38,18 +59,53 @@ for _i in range(256):
     _mag -= 0x84
     _MULAW_DECODE[_i] = -_mag if _sign else _mag
 
+# Squared decoded sample per mu-law byte, so RMS is one gather + sum in NumPy
+_MULAW_SQUARED = np.array(_MULAW_DECODE, dtype=np.float64) ** 2
+
 _VAD_THRESHOLD = 500       # RMS energy threshold (16-bit linear PCM scale)
 _VAD_FRAMES_REQUIRED = 3   # Consecutive frames needed (~60ms at 20ms/frame)
 
 
+# numba compiles the sum of squares to a scalar loop with no per-frame array
+# allocation when installed; the NumPy gather is the fallback.
+try:
+    from numba import njit, types as nb_types
+
+    @njit(
+        nb_types.float64(nb_types.Array(nb_types.uint8, 1, "C", readonly=True)),
+        cache=True, fastmath=True, boundscheck=False,
+    )
+    def _mulaw_sq_sum(frame):
+        sq_sum = 0.0
+        for i in range(frame.shape[0]):
+            sq_sum += _MULAW_SQUARED[frame[i]]
+        return sq_sum
+except ImportError:
+    def _mulaw_sq_sum(frame: np.ndarray) -> float:
+        return float(_MULAW_SQUARED.take(frame).sum())
+
+
 def _audio_rms(data: bytes) -> float:
     """RMS energy of a mu-law audio frame."""
     if not data:
         return 0.0
-    sq_sum = sum(_MULAW_DECODE[b] ** 2 for b in data)
+    sq_sum = _mulaw_sq_sum(np.frombuffer(data, dtype=np.uint8))
     return (sq_sum / len(data)) ** 0.5
 
 
+# 0x01 for mu-law bytes whose decoded magnitude is above the VAD threshold.
+# RMS never exceeds the peak sample, so a frame with none of them is quiet.
+_VAD_LOUD_BYTES = bytes(int(abs(v) > _VAD_THRESHOLD) for v in _MULAW_DECODE)
+
+
+def _is_voiced(data: bytes) -> bool:
+    """Whether a mu-law frame's RMS energy is above the VAD threshold.
+    Quiet frames are rejected by a byte scan without decoding."""
+    if b"\x01" not in data.translate(_VAD_LOUD_BYTES):
+        return False
+    return _audio_rms(data) > _VAD_THRESHOLD
+
+
 # Load environment variables
 load_dotenv()
 
@@ -64,38 +120,198 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Real-Time Voice AI Agent",
     description="Production-ready voice AI for phone calls",
-    version="1.0.0"
+    version="1.0.0",
+    # Serialize JSON endpoints (/, /health, /test/chat) with orjson
+    default_response_class=ORJSONResponse
 )
 
+
+@dataclass(slots=True)
+class CallState:
+    """Per-call bookkeeping for active_calls"""
+    stream_sid: str
+    started_at_ns: int  # time.monotonic_ns() when the stream started
+
+
 # Global instances
 knowledge_base: Optional[KnowledgeBase] = None
-active_calls: Dict[str, Dict] = {}
+active_calls: Dict[str, CallState] = {}
+
+# Multiprocess metrics, set in the environment or .env. prometheus_client
+# picked its value storage when imported, before load_dotenv() ran, so pick
+# again now that the whole configuration is loaded.
+_METRICS_MULTIPROC = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+if _METRICS_MULTIPROC:
+    _multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(_multiproc_dir, exist_ok=True)
+    if __name__ == "__main__":
+        # A new run: gauge files left by a previous one would count as live
+        # data. Cleared before this process creates its own gauges below.
+        for _name in os.listdir(_multiproc_dir):
+            if _name.endswith(".db"):
+                os.remove(os.path.join(_multiproc_dir, _name))
+    values.ValueClass = values.get_value_class()
+
+# Prometheus gauges, updated in place as calls start and end. They live in a
+# module-owned registry: with WORKERS > 1 each worker process executes this
+# module twice (as the spawn parent's __mp_main__, then as "server"), which
+# would register duplicate series in the global one. Workers are separate
+# processes, so WORKERS > 1 needs PROMETHEUS_MULTIPROC_DIR: the gauges then
+# write to files there and /metrics, / and /health aggregate every live
+# worker (multiprocess_mode says how), instead of reporting whichever
+# worker answered.
+METRICS_REGISTRY = CollectorRegistry()
+if not _METRICS_MULTIPROC:
+    # Per-process collectors don't aggregate across workers
+    ProcessCollector(registry=METRICS_REGISTRY)
+    PlatformCollector(registry=METRICS_REGISTRY)
+    GCCollector(registry=METRICS_REGISTRY)
+ACTIVE_CALLS = Gauge("voice_active_calls", "Calls currently streaming",
+                     registry=METRICS_REGISTRY, multiprocess_mode="livesum")
+KB_DOCUMENTS = Gauge("voice_kb_documents", "Documents loaded in the knowledge base",
+                     registry=METRICS_REGISTRY, multiprocess_mode="livemax")
+UPTIME_SECONDS = Gauge("voice_uptime_seconds", "Seconds since server startup",
+                       registry=METRICS_REGISTRY, multiprocess_mode="livemax")
+
+
+def _active_call_count() -> int:
+    """Calls currently streaming, across all workers in multiprocess mode"""
+    if not _METRICS_MULTIPROC:
+        return len(active_calls)
+    for metric in multiprocess.MultiProcessCollector(None).collect():
+        if metric.name == "voice_active_calls":
+            return int(sum(sample.value for sample in metric.samples))
+    return 0
+
+
+# Greeting audio synthesized once at startup; every call opens with the same line
+greeting_audio: Optional[List[bytes]] = None
+# Audio for the agent's canned fast-path replies, keyed by reply text
+fast_reply_audio: Dict[str, List[bytes]] = {}
+
+# Twilio control messages as pre-serialized JSON. Stream SIDs and our mark
+# names are plain ASCII identifiers, so they are spliced in without escaping
+_CLEAR_TEMPLATE = '{"event":"clear","streamSid":"%s"}'
+# Media events are the stream's constant prefix + base64 payload + suffix
+_MEDIA_PREFIX_TEMPLATE = '{"event":"media","streamSid":"%s","media":{"payload":"'
+_MEDIA_SUFFIX = '"}}'
+_MARK_TEMPLATE = '{"event":"mark","streamSid":"%s","mark":{"name":"%s"}}'
+
+# Idle VoiceHandlers kept warm between calls so answering doesn't pay for
+# new API clients and their TLS handshakes
+VOICE_HANDLER_POOL_SIZE = int(os.getenv("VOICE_HANDLER_POOL_SIZE", "4"))
+
+
+def _acquire_voice_handler() -> VoiceHandler:
+    """Take an idle VoiceHandler from the pool, or create one if it's empty"""
+    pool: Optional[asyncio.Queue] = getattr(app.state, "vh_pool", None)
+    if pool is not None and not pool.empty():
+        return pool.get_nowait()
+    return VoiceHandler()
+
+
+async def _release_voice_handler(voice_handler: VoiceHandler):
+    """Reset a VoiceHandler after a call and return it to the pool if there's room"""
+    try:
+        await voice_handler.reset()
+    except Exception as e:
+        logger.error("VoiceHandler reset failed, discarding it: %s", e)
+        return
+    pool: Optional[asyncio.Queue] = getattr(app.state, "vh_pool", None)
+    if pool is not None and not pool.full():
+        pool.put_nowait(voice_handler)
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
-    global knowledge_base
+    global knowledge_base, greeting_audio, fast_reply_audio
 
-    # Track server start time for uptime metrics
-    app.state.start_time = datetime.now(timezone.utc)
+    # Track server start time for uptime metrics (monotonic: immune to clock changes)
+    app.state.start_time_ns = time.monotonic_ns()
+    UPTIME_SECONDS.set_function(lambda: (time.monotonic_ns() - app.state.start_time_ns) / 1e9)
 
     logger.info("Starting Real-Time Voice AI Agent...")
 
+    # API keys don't change while the server runs; /health reports this as-is
+    app.state.api_key_presence = {
+        "anthropic": bool(os.getenv("ANTHROPIC_API_KEY")),
+        "elevenlabs": bool(os.getenv("ELEVENLABS_API_KEY")),
+        "deepgram": bool(os.getenv("DEEPGRAM_API_KEY")),
+        "twilio": bool(os.getenv("TWILIO_ACCOUNT_SID"))
+    }
+
+    # The streaming pipeline awaits on network I/O for every token and audio
+    # frame; uvloop's libuv-based loop cuts that dispatch overhead
+    loop_module = type(asyncio.get_running_loop()).__module__
+    if loop_module.startswith("uvloop"):
+        logger.info("Event loop: uvloop")
+    else:
+        logger.warning(f"Event loop: {loop_module} (install uvloop for lower latency)")
+
     # Initialize knowledge base
     try:
         kb_path = os.getenv("KNOWLEDGE_BASE_PATH", "./knowledge/sample_kb.json")
         knowledge_base = KnowledgeBase()
         await knowledge_base.initialize(kb_path)
+        KB_DOCUMENTS.set(knowledge_base.document_count)
         logger.info(f"Knowledge base initialized with {knowledge_base.document_count} documents")
     except Exception as e:
         logger.warning(f"Knowledge base initialization failed: {e}")
         logger.warning("Server will run without RAG - AI agent will use its built-in knowledge only")
         knowledge_base = None
 
+    # Pre-warm the VoiceHandler pool
+    app.state.vh_pool = asyncio.Queue(maxsize=VOICE_HANDLER_POOL_SIZE)
+    try:
+        for _ in range(VOICE_HANDLER_POOL_SIZE):
+            app.state.vh_pool.put_nowait(VoiceHandler())
+        logger.info(f"VoiceHandler pool warmed with {VOICE_HANDLER_POOL_SIZE} handlers")
+    except Exception as e:
+        logger.warning(f"VoiceHandler pool warmup failed: {e}")
+
+    # Pre-render the greeting so answering a call doesn't wait on ElevenLabs
+    try:
+        voice_handler = _acquire_voice_handler()
+        try:
+            greeting_audio = await voice_handler.prerender_speech(GREETING)
+        finally:
+            await _release_voice_handler(voice_handler)
+        logger.info(f"Greeting audio cached ({sum(len(c) for c in greeting_audio)} bytes)")
+    except Exception as e:
+        logger.warning(f"Greeting pre-render failed, will synthesize per call: {e}")
+        greeting_audio = None
+
+    # Canned replies ("hola", "gracias", "adiós") are fixed text too; with
+    # their audio ready, those turns skip both Claude and ElevenLabs
+    voice_handler = None
+    try:
+        voice_handler = _acquire_voice_handler()
+        rendered = await asyncio.gather(
+            *(voice_handler.prerender_speech(reply) for reply in FAST_PATH_REPLIES),
+            return_exceptions=True
+        )
+        fast_reply_audio = {
+            reply: audio for reply, audio in zip(FAST_PATH_REPLIES, rendered)
+            if not isinstance(audio, BaseException)
+        }
+        logger.info(f"Canned reply audio cached for {len(fast_reply_audio)}/{len(FAST_PATH_REPLIES)} replies")
+    except Exception as e:
+        logger.warning(f"Canned reply pre-render failed, will synthesize per turn: {e}")
+    finally:
+        if voice_handler:
+            await _release_voice_handler(voice_handler)
+
     logger.info("Server ready to accept calls!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Drop this worker's live gauges from the shared metrics"""
+    if _METRICS_MULTIPROC:
+        multiprocess.mark_process_dead(os.getpid())
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -103,7 +319,7 @@ async def root():
         "status": "healthy",
         "service": "Real-Time Voice AI Agent",
         "version": "1.0.0",
-        "active_calls": len(active_calls),
+        "active_calls": _active_call_count(),
         "knowledge_base_ready": knowledge_base is not None
     }
 
@@ -118,21 +334,29 @@ async def root_voice_webhook(request: Request):
     return await voice_webhook(request)
 
 
+# (monotonic second, ISO string) of the last /health timestamp
+_health_timestamp = (-1, "")
+
+
+def _utc_timestamp() -> str:
+    """Current UTC time in ISO format, re-formatted at most once per second"""
+    global _health_timestamp
+    now = int(time.monotonic())
+    if _health_timestamp[0] != now:
+        _health_timestamp = (now, datetime.now(timezone.utc).isoformat())
+    return _health_timestamp[1]
+
+
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
     return {
         "status": "healthy",
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": _utc_timestamp(),
         "checks": {
             "knowledge_base": knowledge_base is not None,
-            "active_calls": len(active_calls),
-            "api_keys": {
-                "anthropic": bool(os.getenv("ANTHROPIC_API_KEY")),
-                "elevenlabs": bool(os.getenv("ELEVENLABS_API_KEY")),
-                "deepgram": bool(os.getenv("DEEPGRAM_API_KEY")),
-                "twilio": bool(os.getenv("TWILIO_ACCOUNT_SID"))
-            }
+            "active_calls": _active_call_count(),
+            "api_keys": app.state.api_key_presence
         }
     }
 
@@ -151,13 +375,15 @@ async def test_chat(request: Request):
     if not os.getenv("ENABLE_TEST_ENDPOINTS", "").lower() in ("true", "1", "yes"):
         return {"error": "Test endpoints disabled. Set ENABLE_TEST_ENDPOINTS=true"}
 
+    ai_agent = None
     try:
         body = await request.json()
         user_text = body.get("text", "")
         if not user_text:
             return {"error": "Missing 'text' field in request body"}
 
-        # Create a temporary AI agent with the shared knowledge base
+        # Create a temporary AI agent with the shared knowledge base. Agents
+        # are cheap: the HTTP/2 pool and tool backends are process-wide.
         ai_agent = AIAgent(knowledge_base=knowledge_base)
         await ai_agent.send_greeting()
 
@@ -185,8 +411,25 @@ async def test_chat(request: Request):
         }
 
     except Exception as e:
-        logger.error(f"Test chat error: {e}", exc_info=True)
+        logger.error("Test chat error: %s", e, exc_info=True)
         return {"error": str(e)}
+    finally:
+        if ai_agent:
+            await ai_agent.cleanup()
+
+
+# Public WebSocket URL for Twilio; derived from the request host when unset
+_WEBSOCKET_URL = os.getenv("WEBSOCKET_URL")
+
+# TwiML connecting a call to the media stream: % (ws_url, call_sid)
+_TWIML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Connect>
+        <Stream url="%s">
+            <Parameter name="callSid" value="%s"/>
+        </Stream>
+    </Connect>
+</Response>"""
 
 
 @app.post("/webhook/voice")
@@ -199,22 +442,13 @@ async def voice_webhook(request: Request):
     call_sid = form_data.get("CallSid")
     from_number = form_data.get("From")
 
-    logger.info(f"Incoming call: {call_sid} from {from_number}")
+    logger.info("Incoming call: %s from %s", call_sid, from_number)
 
     # Get WebSocket URL (use public URL in production)
-    ws_url = os.getenv("WEBSOCKET_URL", f"wss://{request.url.hostname}/ws/media")
+    ws_url = _WEBSOCKET_URL or f"wss://{request.url.hostname}/ws/media"
 
     # Return TwiML to connect call to WebSocket
-    twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Connect>
-        <Stream url="{ws_url}">
-            <Parameter name="callSid" value="{call_sid}"/>
-        </Stream>
-    </Connect>
-</Response>"""
-
-    return Response(content=twiml, media_type="application/xml")
+    return Response(content=_TWIML_TEMPLATE % (ws_url, call_sid), media_type="application/xml")
 
 
 @app.websocket("/ws/media")
@@ -227,91 +461,116 @@ async def websocket_endpoint(websocket: WebSocket):
 
     call_sid = None
     stream_sid = None
+    # Serialized once per stream
+    clear_message: Optional[str] = None
+    media_prefix: Optional[str] = None
     voice_handler = None
     ai_agent = None
+    writer = None
     is_agent_speaking = False
+    # Set by the mark handler when Twilio reports our audio finished playing
+    playback_done = asyncio.Event()
+    # Local test clients (scripts/test_call.py --binary) exchange raw mu-law
+    # binary frames instead of Twilio's base64 JSON media events
+    binary_frames = False
 
     try:
         logger.info("WebSocket connection established")
 
         # Create handler instances
-        voice_handler = VoiceHandler()
+        voice_handler = _acquire_voice_handler()
         ai_agent = AIAgent(knowledge_base=knowledge_base)
+        voice_handler.on_interim_transcript = ai_agent.on_partial_transcript
+
+        async def send_media(audio: bytes):
+            """Encode and send audio to Twilio as one media event
+            (Twilio only accepts text frames for JSON messages)"""
+            if binary_frames:
+                await websocket.send_bytes(audio)
+                return
+            await websocket.send_text(media_prefix + _b64encode(audio) + _MEDIA_SUFFIX)
+
+        # Outbound audio and marks go through one writer task that merges
+        # audio queued during a send into a single media event
+        writer = _TwilioWriter(send_media, websocket.send_text)
+        writer.start()
 
         async def send_audio_to_twilio(audio_chunk: bytes):
-            """Encode and send an audio chunk to Twilio"""
-            nonlocal stream_sid
+            """Queue an audio chunk for Twilio"""
             if not stream_sid:
                 return
-            payload = base64.b64encode(audio_chunk).decode("utf-8")
-            await websocket.send_json({
-                "event": "media",
-                "streamSid": stream_sid,
-                "media": {
-                    "payload": payload
-                }
-            })
+            await writer.put_audio(audio_chunk)
 
         async def clear_twilio_audio():
             """Send clear event to stop Twilio audio playback (for interrupts)"""
-            nonlocal stream_sid
-            if not stream_sid:
+            if not clear_message:
                 return
-            await websocket.send_json({
-                "event": "clear",
-                "streamSid": stream_sid,
-            })
+            writer.drop_audio()
+            await websocket.send_text(clear_message)
 
         async def send_mark(name: str):
-            """Send a mark event to Twilio to track audio playback position"""
-            nonlocal stream_sid
+            """Queue a mark event behind the audio it follows, to track playback position"""
             if not stream_sid:
                 return
-            await websocket.send_json({
-                "event": "mark",
-                "streamSid": stream_sid,
-                "mark": {"name": name}
-            })
+            await writer.put_message(_MARK_TEMPLATE % (stream_sid, name))
 
         async def synthesize_and_send(text: str):
             """Synthesize text to speech and stream to Twilio"""
             nonlocal is_agent_speaking
             is_agent_speaking = True
-            async for audio_chunk in voice_handler.synthesize_speech(text):
-                await send_audio_to_twilio(audio_chunk)
+            await _pipe_audio(voice_handler.synthesize_speech(text), send_audio_to_twilio)
 
         async def receive_audio():
             """Receive audio and control events from Twilio"""
-            nonlocal call_sid, stream_sid, is_agent_speaking
+            nonlocal call_sid, stream_sid, clear_message, media_prefix, is_agent_speaking, binary_frames
             vad_frames = 0  # consecutive high-energy frames
 
             try:
-                async for message in websocket.iter_text():
-                    data = json.loads(message)
-                    event = data.get("event")
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        break
+
+                    raw_audio = message.get("bytes")
+                    if raw_audio is not None:
+                        # Binary frame: raw mu-law audio from a local test client
+                        event = "media"
+                    else:
+                        data = orjson.loads(message["text"])
+                        event = data.get("event")
 
                     if event == "start":
                         call_sid = data["start"]["callSid"]
                         stream_sid = data["start"]["streamSid"]
-                        logger.info(f"Stream started: {stream_sid} for call: {call_sid}")
-                        active_calls[call_sid] = {
-                            "stream_sid": stream_sid,
-                            "started_at": datetime.now(timezone.utc).isoformat()
-                        }
-
-                        # Synthesize and send greeting audio to caller
+                        clear_message = _CLEAR_TEMPLATE % stream_sid
+                        media_prefix = _MEDIA_PREFIX_TEMPLATE % stream_sid
+                        custom_params = data["start"].get("customParameters") or {}
+                        binary_frames = custom_params.get("binaryFrames") == "true"
+                        logger.info("Stream started: %s for call: %s", stream_sid, call_sid)
+                        active_calls[call_sid] = CallState(stream_sid, time.monotonic_ns())
+                        ACTIVE_CALLS.inc()
+
+                        # Send greeting audio to caller, pre-rendered when available
                         greeting_text = await ai_agent.send_greeting()
-                        await synthesize_and_send(greeting_text)
+                        if greeting_audio and greeting_text == GREETING:
+                            is_agent_speaking = True
+                            for audio_chunk in greeting_audio:
+                                await send_audio_to_twilio(audio_chunk)
+                        else:
+                            await synthesize_and_send(greeting_text)
                         await send_mark("greeting_end")
 
                     elif event == "media":
-                        # Decode audio from Twilio (base64 mu-law)
-                        payload = data["media"]["payload"]
-                        audio_data = base64.b64decode(payload)
+                        if raw_audio is not None:
+                            audio_data = raw_audio
+                        else:
+                            # Decode audio from Twilio (base64 mu-law)
+                            payload = data["media"]["payload"]
+                            audio_data = _b64decode(payload)
 
                         # --- VAD: instant interrupt detection on raw audio ---
                         if is_agent_speaking:
-                            if _audio_rms(audio_data) > _VAD_THRESHOLD:
+                            if _is_voiced(audio_data):
                                 vad_frames += 1
                                 if vad_frames >= _VAD_FRAMES_REQUIRED:
                                     logger.info("VAD interrupt: caller speech detected")
@@ -325,25 +584,27 @@ async def websocket_endpoint(websocket: WebSocket):
                             vad_frames = 0
 
                         # Process audio through voice handler (always, for STT)
-                        await voice_handler.process_incoming_audio(audio_data)
+                        voice_handler.feed_audio(audio_data)
 
                     elif event == "mark":
                         # Audio playback completed for this mark
                         mark_name = data.get("mark", {}).get("name", "")
-                        logger.debug(f"Mark received: {mark_name}")
+                        logger.debug("Mark received: %s", mark_name)
                         if mark_name.startswith("response_end") or mark_name == "greeting_end":
                             is_agent_speaking = False
+                            playback_done.set()
 
                     elif event == "stop":
-                        logger.info(f"Stream stopped: {call_sid}")
+                        logger.info("Stream stopped: %s", call_sid)
                         if call_sid in active_calls:
                             del active_calls[call_sid]
+                            ACTIVE_CALLS.dec()
                         break
 
             except WebSocketDisconnect:
                 logger.info("WebSocket disconnected by client")
             except Exception as e:
-                logger.error(f"Error receiving audio: {e}", exc_info=True)
+                logger.error("Error receiving audio: %s", e, exc_info=True)
 
         async def process_speech():
             """
@@ -364,7 +625,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 pending_tts_stream = voice_handler.create_tts_stream()
                 await pending_tts_stream.connect()
             except Exception as e:
-                logger.debug(f"TTS pre-warm failed (will retry inline): {e}")
+                logger.debug("TTS pre-warm failed (will retry inline): %s", e)
                 pending_tts_stream = None
 
             try:
@@ -374,12 +635,12 @@ async def websocket_endpoint(websocket: WebSocket):
                     if not transcript.strip():
                         continue
 
-                    logger.info(f"User: {transcript}")
+                    logger.info("User: %s", transcript)
 
                     # If agent is still speaking (greeting or previous response
                     # still playing in Twilio buffer), interrupt immediately.
                     if is_agent_speaking:
-                        logger.info(f"Interrupt during playback: {transcript}")
+                        logger.info("Interrupt during playback: %s", transcript)
                         await clear_twilio_audio()
                         is_agent_speaking = False
 
@@ -387,11 +648,17 @@ async def websocket_endpoint(websocket: WebSocket):
                     is_agent_speaking = True
                     history_checkpoint = len(ai_agent.conversation_history)
 
+                    # Canned replies play from audio rendered at startup
+                    canned_audio = fast_reply_audio.get(fast_path_reply(transcript))
+
                     # Use the pre-warmed TTS connection if available, otherwise connect now
                     tts_stream = None
                     use_input_streaming = True
 
-                    if pending_tts_stream and pending_tts_stream.ws and pending_tts_stream.ws.open:
+                    if canned_audio:
+                        # Nothing to synthesize; a pre-warmed connection is kept for the next turn
+                        use_input_streaming = False
+                    elif pending_tts_stream and pending_tts_stream.ws and pending_tts_stream.ws.open:
                         tts_stream = pending_tts_stream
                         pending_tts_stream = None
                     else:
@@ -402,10 +669,17 @@ async def websocket_endpoint(websocket: WebSocket):
                             tts_stream = voice_handler.create_tts_stream()
                             await tts_stream.connect()
                         except Exception as e:
-                            logger.warning(f"ElevenLabs WS connect failed, using REST fallback: {e}")
+                            logger.warning("ElevenLabs WS connect failed, using REST fallback: %s", e)
                             use_input_streaming = False
 
-                    if use_input_streaming and tts_stream:
+                    if canned_audio:
+                        # The agent answers these locally (no Claude call) and
+                        # records the exchange in its history
+                        async for _ in ai_agent.process_message(transcript):
+                            pass
+                        for audio_chunk in canned_audio:
+                            await send_audio_to_twilio(audio_chunk)
+                    elif use_input_streaming and tts_stream:
                         # Speculative execution: check queue before first audio
                         # reaches caller to catch Deepgram split-utterances.
                         extra_parts = []
@@ -437,7 +711,7 @@ async def websocket_endpoint(websocket: WebSocket):
                             except _TranscriptExtended:
                                 ai_agent.conversation_history = ai_agent.conversation_history[:history_checkpoint]
                                 transcript += " " + " ".join(extra_parts)
-                                logger.info(f"Transcript extended before audio sent, reprocessing: {transcript}")
+                                logger.info("Transcript extended before audio sent, reprocessing: %s", transcript)
                                 await tts_stream.close()
                                 tts_stream = voice_handler.create_tts_stream()
                                 await tts_stream.connect()
@@ -502,7 +776,7 @@ async def websocket_endpoint(websocket: WebSocket):
                                     try:
                                         response_task.result()
                                     except Exception as e:
-                                        logger.error(f"Response error: {e}", exc_info=True)
+                                        logger.error("Response error: %s", e, exc_info=True)
                                 break
 
                         if interrupted:
@@ -527,66 +801,80 @@ async def websocket_endpoint(websocket: WebSocket):
                     # Twilio's buffer.  Send a mark so we know when playback
                     # ends, then monitor for user interrupts in the meantime.
                     response_counter += 1
+                    playback_done.clear()
                     await send_mark(f"response_end_{response_counter}")
 
                     # Monitor for interrupts while Twilio plays the buffered audio.
                     # Uses speech_detected (interim results) for near-instant reaction.
-                    # The mark handler in receive_audio sets is_agent_speaking=False
-                    # once Twilio confirms playback is done.
-                    while is_agent_speaking:
+                    # The mark handler in receive_audio sets playback_done once
+                    # Twilio confirms playback is done; whichever fires first wins.
+                    if is_agent_speaking:
+                        speech_waiter = asyncio.create_task(voice_handler.speech_detected.wait())
+                        playback_waiter = asyncio.create_task(playback_done.wait())
                         try:
-                            await asyncio.wait_for(
-                                voice_handler.speech_detected.wait(),
-                                timeout=0.1
+                            await asyncio.wait(
+                                {speech_waiter, playback_waiter},
+                                return_when=asyncio.FIRST_COMPLETED,
                             )
+                        finally:
+                            for waiter in (speech_waiter, playback_waiter):
+                                waiter.cancel()
+                                with contextlib.suppress(asyncio.CancelledError):
+                                    await waiter
+
+                        if voice_handler.speech_detected.is_set() and not playback_done.is_set():
                             # User started speaking during playback — stop immediately
                             logger.info("Interrupt during Twilio playback")
                             voice_handler.speech_detected.clear()
                             await clear_twilio_audio()
-                            is_agent_speaking = False
-                            break
-                        except asyncio.TimeoutError:
-                            continue
 
                     is_agent_speaking = False
 
-                    # Pre-warm the next TTS connection while idle
-                    try:
-                        pending_tts_stream = voice_handler.create_tts_stream()
-                        await pending_tts_stream.connect()
-                    except Exception:
-                        pending_tts_stream = None
+                    # Pre-warm the next TTS connection while idle (a canned
+                    # reply leaves the previous one unused)
+                    if pending_tts_stream is None:
+                        try:
+                            pending_tts_stream = voice_handler.create_tts_stream()
+                            await pending_tts_stream.connect()
+                        except Exception:
+                            pending_tts_stream = None
 
             except asyncio.CancelledError:
                 logger.info("Speech processing cancelled")
             except Exception as e:
-                logger.error(f"Error processing speech: {e}", exc_info=True)
+                logger.error("Error processing speech: %s", e, exc_info=True)
             finally:
                 if pending_tts_stream:
                     await pending_tts_stream.close()
 
-        # Run both tasks concurrently
-        tasks = [
-            asyncio.create_task(receive_audio()),
-            asyncio.create_task(process_speech())
-        ]
-
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # Responses run in a single background task while this coroutine
+        # drives the receive loop; when the stream ends, stop responding
+        speech_task = asyncio.ensure_future(process_speech())
+        try:
+            await receive_audio()
+        finally:
+            speech_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await speech_task
 
     except Exception as e:
-        logger.error(f"WebSocket error: {e}", exc_info=True)
+        logger.error("WebSocket error: %s", e, exc_info=True)
 
     finally:
+        if writer:
+            await writer.close()
+
         if call_sid and call_sid in active_calls:
             del active_calls[call_sid]
+            ACTIVE_CALLS.dec()
 
         if voice_handler:
-            await voice_handler.cleanup()
+            await _release_voice_handler(voice_handler)
 
         if ai_agent:
             await ai_agent.cleanup()
 
-        logger.info(f"WebSocket connection closed: {call_sid}")
+        logger.info("WebSocket connection closed: %s", call_sid)
 
 
 class _TranscriptExtended(Exception):
@@ -637,7 +925,7 @@ async def _process_with_input_streaming(ai_agent, transcript, tts_stream, send_a
                 if text_buffer:
                     await tts_stream.send_text(text_buffer, try_trigger=True)
                     text_buffer = ""
-                logger.info(f"Executing tool: {chunk['name']}")
+                logger.info("Executing tool: %s", chunk["name"])
 
             elif chunk.get("type") == "error":
                 await tts_stream.send_text(chunk["content"], try_trigger=True)
@@ -661,66 +949,226 @@ async def _process_with_input_streaming(ai_agent, transcript, tts_stream, send_a
         raise
 
 
+# Max mu-law bytes merged into one outbound media event (500ms at 8kHz)
+_MEDIA_COALESCE_BYTES = 4000
+# Audio chunks and marks waiting for the writer; a full queue makes TTS wait
+_WRITER_QUEUE_SIZE = 64
+
+
+class _TwilioWriter:
+    """
+    Single writer for audio and mark events going to Twilio.
+    Audio chunks that queue up while a send is in flight are joined and sent
+    as one media event, so a burst of TTS output costs a few WebSocket frames
+    instead of one per chunk. Marks keep their position behind the audio.
+    After a failed send the writer is closed and later items are dropped.
+    """
+
+    def __init__(self, send_media, send_message, max_bytes: int = _MEDIA_COALESCE_BYTES):
+        self._send_media = send_media
+        self._send_message = send_message
+        self._max_bytes = max_bytes
+        # bytes items are audio, str items are pre-serialized messages
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=_WRITER_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def put_audio(self, audio_chunk: bytes):
+        if not self.closed:
+            await self._queue.put(audio_chunk)
+
+    async def put_message(self, message: str):
+        if not self.closed:
+            await self._queue.put(message)
+
+    def drop_audio(self):
+        """Discard queued audio (on interrupt), keeping queued messages"""
+        messages = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if isinstance(item, str):
+                messages.append(item)
+        for message in messages:
+            self._queue.put_nowait(message)
+
+    async def _run(self):
+        try:
+            while True:
+                item = await self._queue.get()
+                if isinstance(item, str):
+                    await self._send_message(item)
+                    continue
+
+                batch = [item]
+                size = len(item)
+                message = None
+                while size < self._max_bytes and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if isinstance(item, str):
+                        message = item
+                        break
+                    batch.append(item)
+                    size += len(item)
+
+                await self._send_media(batch[0] if len(batch) == 1 else b"".join(batch))
+                if message is not None:
+                    await self._send_message(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Twilio writer stopped, dropping further audio: %s", e)
+            self.closed = True
+            # Free the queue so puts blocked on it return
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+
+# Synthesized audio chunks buffered between TTS and the Twilio sender
+_TTS_QUEUE_SIZE = 8
+
+
+async def _pipe_audio(audio_chunks: AsyncIterator[bytes], send_audio_fn):
+    """
+    Forward audio chunks to send_audio_fn through a bounded queue.
+    A producer task keeps pulling from TTS while the current chunk is being
+    sent, so synthesis and Twilio sends overlap instead of taking turns.
+    Errors from either side propagate to the caller.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_TTS_QUEUE_SIZE)
+
+    async def produce():
+        try:
+            async for audio_chunk in audio_chunks:
+                await queue.put(audio_chunk)
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)  # Signal end of audio
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (audio_chunk := await queue.get()) is not None:
+            await send_audio_fn(audio_chunk)
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+
+
 async def _process_with_sentence_buffering(ai_agent, transcript, synthesize_and_send_fn):
     """Fallback: sentence-by-sentence REST TTS (original approach)."""
-    sentence_buffer = ""
+    # Unspoken text is kept as a list of chunks and only joined when a chunk
+    # completes a sentence, so each token costs O(len(token)) rather than a
+    # copy of the whole buffer
+    pending: List[str] = []
+    last_char = ""
 
     async for chunk in ai_agent.process_message(transcript):
         if chunk.get("type") == "text":
-            sentence_buffer += chunk["content"]
-
+            text = chunk["content"]
+            if not text:
+                continue
+            pending.append(text)
+
+            # A boundary is two characters, so it can only end in this chunk
+            # or straddle its first character
+            found = _find_sentence_boundary(last_char + text) != -1
+            last_char = text[-1]
+            if not found:
+                continue
+
+            sentence_buffer = "".join(pending)
+            cursor = 0
             while True:
-                boundary = _find_sentence_boundary(sentence_buffer)
+                boundary = _find_sentence_boundary(sentence_buffer, cursor)
                 if boundary == -1:
                     break
-                sentence = sentence_buffer[:boundary].strip()
-                sentence_buffer = sentence_buffer[boundary:]
+                sentence = sentence_buffer[cursor:boundary].strip()
+                cursor = boundary
                 if sentence:
                     await synthesize_and_send_fn(sentence)
+            pending = [sentence_buffer[cursor:]]
 
         elif chunk.get("type") == "tool_call":
-            logger.info(f"Executing tool: {chunk['name']}")
+            logger.info("Executing tool: %s", chunk["name"])
 
         elif chunk.get("type") == "error":
             await synthesize_and_send_fn(chunk["content"])
 
-    if sentence_buffer.strip():
-        await synthesize_and_send_fn(sentence_buffer.strip())
+    remainder = "".join(pending).strip()
+    if remainder:
+        await synthesize_and_send_fn(remainder)
+
 
+# Sentence end: terminal punctuation followed by a space or newline
+_SENTENCE_END_RE = re.compile(r"[.!?][ \n]")
 
-def _find_sentence_boundary(text: str) -> int:
+
+def _find_sentence_boundary(text: str, start: int = 0) -> int:
     """
-    Find the position of the first sentence boundary in text.
+    Find the position of the first sentence boundary in text at or after start.
     Returns the index just past the boundary, or -1 if no boundary found.
     Handles common sentence endings followed by space or newline.
     """
-    for punct in [". ", "! ", "? ", ".\n", "!\n", "?\n"]:
-        idx = text.find(punct)
-        if idx != -1:
-            return idx + len(punct)
-    return -1
+    match = _SENTENCE_END_RE.search(text, start)
+    return match.end() if match else -1
 
 
 @app.get("/metrics")
 async def metrics():
-    """Prometheus-compatible metrics endpoint"""
-    return {
-        "active_calls": len(active_calls),
-        "total_documents": knowledge_base.document_count if knowledge_base else 0,
-        "uptime_seconds": (datetime.now(timezone.utc) - app.state.start_time).total_seconds() if hasattr(app.state, "start_time") else 0
-    }
+    """Prometheus metrics endpoint (text exposition format)"""
+    if not _METRICS_MULTIPROC:
+        return Response(generate_latest(METRICS_REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    # set_function values never reach the shared files, so store the uptime
+    # now; then read every worker's gauge files into a fresh registry, as
+    # prometheus_client's multiprocess docs prescribe
+    UPTIME_SECONDS.set((time.monotonic_ns() - app.state.start_time_ns) / 1e9)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
 
 
 if __name__ == "__main__":
     # Run server
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
+    # Each worker is a separate process with its own event loop, knowledge
+    # base and call bookkeeping; uvicorn shares the listening socket
+    workers = int(os.getenv("WORKERS", 1))
+    if workers > 1 and not _METRICS_MULTIPROC:
+        raise SystemExit(
+            "WORKERS > 1 needs PROMETHEUS_MULTIPROC_DIR so metrics and call "
+            "counts cover every worker, not just the one that answers"
+        )
 
     logger.info(f"Starting server on {host}:{port}")
 
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+
     uvicorn.run(
-        app,
+        # Worker processes import the app themselves, which needs an import string
+        "server:app" if workers > 1 else app,
+        workers=workers,
         host=host,
         port=port,
+        loop=loop,
+        # Media frames are base64 mu-law, which deflate can't shrink, so
+        # compressing them only burns CPU on every 20ms frame
+        ws_per_message_deflate=False,
         log_level=os.getenv("LOG_LEVEL", "info").lower()
     )
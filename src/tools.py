@@ -41,7 +41,7 @@ class AppointmentManager:
             with open(self.db_path, 'w') as f:
                 json.dump(self.appointments, f, indent=2)
         except Exception as e:
-            logger.error(f"Error saving appointments: {e}")
+            logger.error("Error saving appointments: %s", e)
     
     async def book_appointment(
         self,
@@ -63,7 +63,7 @@ class AppointmentManager:
             Dict with success status and confirmation details
         """
         try:
-            logger.info(f"📅 Booking appointment for {name} on {date} at {time}")
+            logger.info("📅 Booking appointment for %s on %s at %s", name, date, time)
             
             # Validate date format
             try:
@@ -115,7 +115,7 @@ class AppointmentManager:
             # Save to file
             self._save_appointments()
             
-            logger.info(f"✅ Appointment booked: {appointment_id}")
+            logger.info("✅ Appointment booked: %s", appointment_id)
             
             return {
                 "success": True,
@@ -127,7 +127,7 @@ class AppointmentManager:
             }
             
         except Exception as e:
-            logger.error(f"Error booking appointment: {e}", exc_info=True)
+            logger.error("Error booking appointment: %s", e, exc_info=True)
             return {
                 "success": False,
                 "error": f"Failed to book appointment: {str(e)}"
@@ -144,7 +144,7 @@ class AppointmentManager:
             Dict with appointment details or error
         """
         try:
-            logger.info(f"🔍 Checking appointments for phone: {phone}")
+            logger.info("🔍 Checking appointments for phone: %s", phone)
             
             # Find appointments for this phone number
             found_appointments = []
@@ -174,7 +174,7 @@ class AppointmentManager:
             }
             
         except Exception as e:
-            logger.error(f"Error checking appointment: {e}", exc_info=True)
+            logger.error("Error checking appointment: %s", e, exc_info=True)
             return {
                 "success": False,
                 "error": f"Failed to check appointment: {str(e)}"
@@ -205,7 +205,7 @@ class EscalationHandler:
             Dict with escalation status
         """
         try:
-            logger.info(f"🆘 Escalating call: {reason}")
+            logger.info("🆘 Escalating call: %s", reason)
             
             # Create support ticket
             ticket_id = f"TICKET-{datetime.now().strftime('%Y%m%d%H%M%S')}"
@@ -232,7 +232,7 @@ class EscalationHandler:
             with open(tickets_path, 'w') as f:
                 json.dump(tickets, f, indent=2)
             
-            logger.info(f"✅ Support ticket created: {ticket_id}")
+            logger.info("✅ Support ticket created: %s", ticket_id)
             
             return {
                 "success": True,
@@ -242,7 +242,7 @@ class EscalationHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error escalating: {e}", exc_info=True)
+            logger.error("Error escalating: %s", e, exc_info=True)
             return {
                 "success": False,
                 "error": f"Failed to escalate: {str(e)}"
@@ -4,9 +4,10 @@ Manages bidirectional audio streaming with Deepgram and ElevenLabs
 """
 
 import asyncio
+import contextlib
 import os
 import logging
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, Callable, List, Optional
 from io import BytesIO
 
 from deepgram import (
@@ -16,9 +17,9 @@ from deepgram import (
     LiveOptions,
 )
 from elevenlabs.client import ElevenLabs
+import orjson
 import websockets as ws_lib
 import base64 as b64_lib
-import json as json_lib
 
 logger = logging.getLogger(__name__)
 
@@ -51,9 +52,14 @@ class VoiceHandler:
         # Much faster than waiting for final transcripts (~100ms vs ~400ms).
         self.speech_detected = asyncio.Event()
 
+        # Optional hook called with each interim transcript (e.g. to start
+        # speculative LLM prefill before the final result arrives)
+        self.on_interim_transcript: Optional[Callable[[str], None]] = None
+
         # Deepgram connection
         self.dg_connection = None
         self.is_transcribing = False
+        self._transcription_task: Optional[asyncio.Task] = None
 
         logger.info("VoiceHandler initialized")
 
@@ -62,18 +68,38 @@ class VoiceHandler:
         Process incoming audio from Twilio
         Audio format: mu-law, 8kHz, mono
         """
+        self.feed_audio(audio_data)
+
+    def feed_audio(self, audio_data: bytes):
+        """
+        Queue a caller audio frame for STT without awaiting, so the receive
+        loop doesn't pay for a coroutine per 20ms frame
+        """
         try:
-            # Add to buffer for STT
-            await self.audio_buffer.put(audio_data)
+            # Add to buffer for STT (unbounded, so never blocks)
+            self.audio_buffer.put_nowait(audio_data)
 
             # Start transcription if not already running
             # Set flag BEFORE creating task to prevent race condition
             if not self.is_transcribing:
                 self.is_transcribing = True
-                asyncio.create_task(self._start_transcription())
+                self._transcription_task = asyncio.create_task(self._start_transcription())
 
         except Exception as e:
-            logger.error(f"Error processing audio: {e}")
+            logger.error("Error processing audio: %s", e)
+
+    def _drain_audio(self, first: bytes) -> bytes:
+        """
+        Join first with the frames already waiting in audio_buffer. Frames
+        only queue up while the sender is behind, so this batches the backlog
+        into one Deepgram send without ever holding audio back.
+        """
+        if self.audio_buffer.empty():
+            return first
+        frames = [first]
+        while not self.audio_buffer.empty():
+            frames.append(self.audio_buffer.get_nowait())
+        return b"".join(frames)
 
     async def _start_transcription(self):
         """Start Deepgram streaming transcription"""
@@ -108,15 +134,17 @@ class VoiceHandler:
                         # Only enqueue final results for AI processing
                         if result.is_final:
                             await handler.transcript_queue.put(sentence)
-                            logger.info(f"Transcript (final): {sentence}")
+                            logger.info("Transcript (final): %s", sentence)
                         else:
-                            logger.debug(f"Transcript (interim): {sentence}")
+                            logger.debug("Transcript (interim): %s", sentence)
+                            if handler.on_interim_transcript:
+                                handler.on_interim_transcript(sentence)
                 except Exception as e:
-                    logger.error(f"Transcription callback error: {e}")
+                    logger.error("Transcription callback error: %s", e)
 
             async def on_error(_self, error, **kwargs):
                 """Handle Deepgram errors"""
-                logger.error(f"Deepgram error: {error}")
+                logger.error("Deepgram error: %s", error)
 
             self.dg_connection.on(LiveTranscriptionEvents.Transcript, on_message)
             self.dg_connection.on(LiveTranscriptionEvents.Error, on_error)
@@ -132,14 +160,16 @@ class VoiceHandler:
             try:
                 while self.is_transcribing:
                     try:
-                        # Get audio from buffer with timeout
-                        audio_chunk = await asyncio.wait_for(
-                            self.audio_buffer.get(),
-                            timeout=5.0
-                        )
+                        # Take queued audio directly; only park on the queue
+                        # (without wait_for's per-call task) when it's empty
+                        try:
+                            audio_chunk = self.audio_buffer.get_nowait()
+                        except asyncio.QueueEmpty:
+                            async with asyncio.timeout(5.0):
+                                audio_chunk = await self.audio_buffer.get()
 
-                        # Send to Deepgram
-                        await self.dg_connection.send(audio_chunk)
+                        # Send to Deepgram, with any frames that queued up behind it
+                        await self.dg_connection.send(self._drain_audio(audio_chunk))
 
                     except asyncio.TimeoutError:
                         # Keep connection alive during silence
@@ -147,13 +177,13 @@ class VoiceHandler:
                         continue
 
             except Exception as e:
-                logger.error(f"Error streaming to Deepgram: {e}")
+                logger.error("Error streaming to Deepgram: %s", e)
             finally:
                 # Close connection
                 await self.dg_connection.finish()
 
         except Exception as e:
-            logger.error(f"Transcription error: {e}", exc_info=True)
+            logger.error("Transcription error: %s", e, exc_info=True)
         finally:
             self.is_transcribing = False
 
@@ -170,7 +200,7 @@ class VoiceHandler:
         except asyncio.CancelledError:
             logger.info("Transcription stream cancelled")
         except Exception as e:
-            logger.error(f"Error in transcribe stream: {e}")
+            logger.error("Error in transcribe stream: %s", e)
 
     async def synthesize_speech(self, text: str) -> AsyncIterator[bytes]:
         """
@@ -178,7 +208,7 @@ class VoiceHandler:
         Returns audio chunks in mu-law format for Twilio
         """
         try:
-            logger.info(f"Synthesizing: {text[:80]}...")
+            logger.info("Synthesizing: %.80s...", text)
 
             # Generate audio with ElevenLabs streaming API (v1.x SDK)
             audio_stream = self.elevenlabs_client.text_to_speech.convert_as_stream(
@@ -189,16 +219,35 @@ class VoiceHandler:
                 optimize_streaming_latency="4",
             )
 
-            # Stream audio chunks without artificial delay
-            for chunk in audio_stream:
+            # The SDK stream is a blocking iterator; step it in a worker thread
+            # so waiting on ElevenLabs doesn't stall the event loop
+            audio_iter = iter(audio_stream)
+            while True:
+                chunk = await asyncio.to_thread(next, audio_iter, None)
+                if chunk is None:
+                    break
                 if chunk:
                     yield chunk
 
         except Exception as e:
-            logger.error(f"TTS error: {e}", exc_info=True)
+            logger.error("TTS error: %s", e, exc_info=True)
             # Return silence on error
             yield b'\x00' * 160
 
+    async def prerender_speech(self, text: str) -> List[bytes]:
+        """
+        Synthesize text fully into mu-law chunks for reuse (e.g. the greeting).
+        Unlike synthesize_speech, errors are raised instead of yielding silence.
+        """
+        audio_stream = self.elevenlabs_client.text_to_speech.convert_as_stream(
+            text=text,
+            voice_id=self.voice_id,
+            model_id="eleven_turbo_v2_5",
+            output_format="ulaw_8000",
+        )
+        # The SDK stream is a blocking iterator; drain it off the event loop
+        return await asyncio.to_thread(lambda: [chunk for chunk in audio_stream if chunk])
+
     def create_tts_stream(self) -> "ElevenLabsInputStreamer":
         """Create a new ElevenLabs WebSocket-based input streamer for lowest latency TTS"""
         return ElevenLabsInputStreamer(
@@ -217,7 +266,29 @@ class VoiceHandler:
             logger.info("VoiceHandler cleaned up")
 
         except Exception as e:
-            logger.error(f"Cleanup error: {e}")
+            logger.error("Cleanup error: %s", e)
+
+    async def reset(self):
+        """
+        Return the handler to a fresh state so a pool can hand it to the next call.
+        The API clients (and their open connections) are kept.
+        """
+        await self.cleanup()
+
+        # Stop the previous call's Deepgram streaming loop so it can't pick up
+        # the next call's audio
+        task = self._transcription_task
+        if task and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._transcription_task = None
+        self.dg_connection = None
+
+        self.audio_buffer = asyncio.Queue()
+        self.transcript_queue = asyncio.Queue()
+        self.speech_detected.clear()
+        self.on_interim_transcript = None
 
 
 class ElevenLabsInputStreamer:
@@ -257,7 +328,7 @@ class ElevenLabsInputStreamer:
         self.ws = await ws_lib.connect(url)
 
         # Send BOS (beginning of stream) message with voice config
-        await self.ws.send(json_lib.dumps({
+        await self.ws.send(orjson.dumps({
             "text": " ",
             "voice_settings": {
                 "stability": 0.5,
@@ -269,7 +340,7 @@ class ElevenLabsInputStreamer:
                 "chunk_length_schedule": [50, 75, 100, 125, 150]
             },
             "xi_api_key": self.api_key,
-        }))
+        }).decode())
 
         # Start receiving audio in background
         self._receive_task = asyncio.create_task(self._receive_audio())
@@ -285,18 +356,19 @@ class ElevenLabsInputStreamer:
             msg = {"text": text}
             if try_trigger:
                 msg["try_trigger_generation"] = True
-            await self.ws.send(json_lib.dumps(msg))
+            # ElevenLabs expects JSON in text frames; bytes would go out as binary
+            await self.ws.send(orjson.dumps(msg).decode())
 
     async def flush(self):
         """Send EOS (end of stream) to signal no more text is coming"""
         if self.ws:
-            await self.ws.send(json_lib.dumps({"text": ""}))
+            await self.ws.send('{"text":""}')
 
     async def _receive_audio(self):
         """Receive audio chunks from ElevenLabs WebSocket"""
         try:
             async for message in self.ws:
-                data = json_lib.loads(message)
+                data = orjson.loads(message)
                 if data.get("audio"):
                     audio_bytes = b64_lib.b64decode(data["audio"])
                     await self.audio_queue.put(audio_bytes)
@@ -305,7 +377,7 @@ class ElevenLabsInputStreamer:
         except ws_lib.exceptions.ConnectionClosed:
             logger.debug("ElevenLabs WS connection closed")
         except Exception as e:
-            logger.error(f"ElevenLabs WS receive error: {e}")
+            logger.error("ElevenLabs WS receive error: %s", e)
         finally:
             await self.audio_queue.put(None)  # Signal end of audio
 
@@ -4,9 +4,11 @@ Unit tests for AIAgent - conversation history, tool handling, and streaming
 
 import pytest
 import asyncio
+import numpy as np
 import os
 import sys
 import json
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock, AsyncMock
 
 # Mock environment variables before importing
@@ -16,12 +18,46 @@ os.environ.setdefault("ELEVENLABS_API_KEY", "test-elevenlabs-key")
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from ai_agent import AIAgent
+import ai_agent as ai_agent_module
+from ai_agent import AIAgent, GREETING, MAX_HISTORY_MESSAGES
+from knowledge_base import KnowledgeBase
+
+
+def make_stream(events):
+    """Build a mock Anthropic message stream that yields the given events"""
+    stream = MagicMock()
+    stream.__aenter__ = AsyncMock(return_value=stream)
+    stream.__aexit__ = AsyncMock(return_value=False)
+    stream.__aiter__.return_value = events
+    return stream
+
+
+def text_events(text, stop_reason="end_turn"):
+    """Stream events for a plain text response"""
+    return [
+        SimpleNamespace(type="content_block_start", content_block=SimpleNamespace(type="text")),
+        SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=text)),
+        SimpleNamespace(type="content_block_stop"),
+        SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason)),
+    ]
+
+
+def tool_use_events(name, input_json, tool_id="toolu_1"):
+    """Stream events for a single tool_use block"""
+    return [
+        SimpleNamespace(type="content_block_start",
+                        content_block=SimpleNamespace(type="tool_use", id=tool_id, name=name)),
+        SimpleNamespace(type="content_block_delta",
+                        delta=SimpleNamespace(type="input_json_delta", partial_json=input_json)),
+        SimpleNamespace(type="content_block_stop"),
+    ]
 
 
 @pytest.fixture
 def ai_agent():
     """Create an AIAgent with mocked Anthropic client"""
+    # Replies are cached across agents; start every test cold
+    ai_agent_module._response_cache.clear()
     with patch("ai_agent.AsyncAnthropic"):
         agent = AIAgent(knowledge_base=None)
         yield agent
@@ -38,13 +74,437 @@ class TestSendGreeting:
         assert len(greeting) > 0
 
     @pytest.mark.asyncio
-    async def test_greeting_added_to_history(self, ai_agent):
-        """Greeting should be added to conversation history"""
-        assert len(ai_agent.conversation_history) == 0
-        await ai_agent.send_greeting()
-        assert len(ai_agent.conversation_history) == 1
-        assert ai_agent.conversation_history[0]["role"] == "assistant"
-        assert "ByteAI" in ai_agent.conversation_history[0]["content"]
+    async def test_greeting_kept_out_of_history(self, ai_agent):
+        """Greeting should live in the system prompt, not conversation history"""
+        greeting = await ai_agent.send_greeting()
+        assert greeting == GREETING
+        assert ai_agent.conversation_history == []
+        assert GREETING in ai_agent.system_prompt
+
+
+class TestKnowledgeBasePrompt:
+    """Tests for embedding the knowledge base in the system prompt"""
+
+    def test_agents_share_prompt(self):
+        """Agents sharing a KB should embed its text and share one prompt"""
+        kb = MagicMock()
+        kb.documents = [{"id": "1"}]
+        kb.get_all_documents_text.return_value = "\n\nKB: horario 9-17"
+        with patch("ai_agent.AsyncAnthropic"):
+            first = AIAgent(knowledge_base=kb)
+            second = AIAgent(knowledge_base=kb)
+
+        kb.get_all_documents_text.assert_called_with(max_chars=32000)
+        assert first.system_prompt.endswith("KB: horario 9-17")
+        assert second.system_prompt is first.system_prompt
+
+    @pytest.mark.asyncio
+    async def test_kb_reload_rerenders(self, tmp_path, monkeypatch):
+        """Reloading the knowledge base should invalidate its memoized prompt text"""
+        monkeypatch.setenv("KB_MODE", "inline")
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        monkeypatch.chdir(tmp_path)
+        kb_path = tmp_path / "kb.json"
+        with patch("knowledge_base.chromadb"):
+            kb = KnowledgeBase()
+
+        kb_path.write_text(json.dumps({"documents": [
+            {"id": "1", "category": "horarios", "question": "¿Horario?", "answer": "De 9 a 17."},
+        ]}))
+        await kb.initialize(str(kb_path))
+        with patch("ai_agent.AsyncAnthropic"):
+            before = AIAgent(knowledge_base=kb)
+
+        kb_path.write_text(json.dumps({"documents": [
+            {"id": "1", "category": "horarios", "question": "¿Horario?", "answer": "De 8 a 20."},
+        ]}))
+        await kb.initialize(str(kb_path))
+        with patch("ai_agent.AsyncAnthropic"):
+            after = AIAgent(knowledge_base=kb)
+
+        assert "A: De 9 a 17." in before.system_prompt
+        assert "A: De 8 a 20." in after.system_prompt
+        assert "De 9 a 17." not in after.system_prompt
+
+
+class TestSharedToolBackends:
+    """Tests for sharing tool backends across calls"""
+
+    def test_agents_share_appointment_book(self):
+        """Concurrent calls should book into the same AppointmentManager"""
+        with patch("ai_agent.AsyncAnthropic"):
+            first = AIAgent(knowledge_base=None)
+            second = AIAgent(knowledge_base=None)
+
+        assert first.appointment_manager is second.appointment_manager
+        assert first.escalation_handler is second.escalation_handler
+
+
+class TestPromptCacheWarmup:
+    """Tests for warming the prompt cache at call start"""
+
+    @pytest.mark.asyncio
+    async def test_greeting_warms_cache_once(self, ai_agent):
+        """The first greeting should fire one warmup with the cached prefix"""
+        ai_agent.client.messages.create = AsyncMock()
+        with patch("ai_agent._last_cache_warm", 0.0), patch("ai_agent._cache_warm_task", None):
+            await ai_agent.send_greeting()
+            await ai_agent._warmup_task
+            await ai_agent.send_greeting()
+
+        ai_agent.client.messages.create.assert_awaited_once()
+        kwargs = ai_agent.client.messages.create.call_args.kwargs
+        assert kwargs["max_tokens"] == 1
+        assert kwargs["system"] is ai_agent._cached_system
+        assert len(kwargs["tools"]) == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_or_cancelled_warmup_is_retried(self, ai_agent):
+        """Only a completed warmup should hold off the next one"""
+        ai_agent.client.messages.create = AsyncMock(side_effect=[Exception("network"), None, None])
+        with patch("ai_agent._last_cache_warm", 0.0), patch("ai_agent._cache_warm_task", None):
+            await ai_agent.send_greeting()
+            await ai_agent._warmup_task
+
+            # Cancelled before the request completes, as cleanup() does on a short call
+            await ai_agent.send_greeting()
+            await ai_agent.cleanup()
+            with pytest.raises(asyncio.CancelledError):
+                await ai_agent._warmup_task
+
+            await ai_agent.send_greeting()
+            await ai_agent._warmup_task
+            await ai_agent.send_greeting()
+
+        assert ai_agent.client.messages.create.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_warmup_failure_is_swallowed(self, ai_agent):
+        """A failed warmup should not raise"""
+        ai_agent.client.messages.create = AsyncMock(side_effect=Exception("network"))
+        await ai_agent.warm_prompt_cache()
+
+
+class TestSpeculativePrefill:
+    """Tests for prefilling on interim transcripts"""
+
+    @pytest.mark.asyncio
+    async def test_prefill_once_per_turn(self, ai_agent):
+        """Only the first partial of a turn should fire a prefill"""
+        ai_agent.conversation_history = [
+            {"role": "user", "content": "Hola"},
+            {"role": "assistant", "content": "¿En qué le ayudo?"},
+        ]
+        ai_agent.client.messages.create = AsyncMock()
+
+        ai_agent.prefill_partial("Quiero")
+        ai_agent.prefill_partial("Quiero una cita")
+        await ai_agent._prefill_task
+
+        ai_agent.client.messages.create.assert_awaited_once()
+        sent = ai_agent.client.messages.create.call_args.kwargs["messages"]
+        assert sent[-2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert sent[-1] == {"role": "user", "content": "Quiero"}
+        # History itself is left untouched
+        assert ai_agent.conversation_history[-1]["content"] == "¿En qué le ayudo?"
+
+    @pytest.mark.asyncio
+    async def test_turn_reads_prefilled_prefix(self, ai_agent):
+        """The real turn should put its breakpoint on the same message as the prefill"""
+        ai_agent.conversation_history = [
+            {"role": "user", "content": "Hola"},
+            {"role": "assistant", "content": "¿En qué le ayudo?"},
+        ]
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(text_events("Claro.")))
+
+        async for _ in ai_agent.process_message("Quiero una cita"):
+            pass
+
+        sent = ai_agent.client.messages.stream.call_args.kwargs["messages"]
+        assert sent[-2]["content"] == [{
+            "type": "text", "text": "¿En qué le ayudo?", "cache_control": {"type": "ephemeral"}
+        }]
+        assert sent[-1] == {"role": "user", "content": "Quiero una cita"}
+
+
+class TestSpeculativeResponse:
+    """Tests for starting the reply on interim transcripts"""
+
+    @pytest.mark.asyncio
+    async def test_matching_final_reuses_stream(self, ai_agent):
+        """A final transcript matching the speculated one should not reopen the stream"""
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(text_events("Claro.")))
+
+        ai_agent.speculate_partial("Quiero una cita.")
+        await asyncio.sleep(0)
+
+        chunks = [c["content"] async for c in ai_agent.process_message("quiero una cita") if c["type"] == "text"]
+
+        ai_agent.client.messages.stream.assert_called_once()
+        assert "".join(chunks) == "Claro."
+        assert ai_agent.conversation_history == [
+            {"role": "user", "content": "quiero una cita"},
+            {"role": "assistant", "content": "Claro."},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_mismatched_final_restarts_stream(self, ai_agent):
+        """A final transcript that differs should discard the speculation"""
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Claro."))
+        )
+
+        ai_agent.speculate_partial("Quiero una cita.")
+        await asyncio.sleep(0)
+        async for _ in ai_agent.process_message("Quiero una cita para mañana"):
+            pass
+
+        assert ai_agent.client.messages.stream.call_count == 2
+        assert ai_agent.conversation_history == [
+            {"role": "user", "content": "Quiero una cita para mañana"},
+            {"role": "assistant", "content": "Claro."},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_unused_speculation_cancelled(self, ai_agent):
+        """A speculation the turn doesn't replay should be cancelled, not left running"""
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(text_events("Claro.")))
+
+        # Not a fast path as a question, but its final form is
+        ai_agent.speculate_partial("Muchas gracias?")
+        task = ai_agent._speculation[2]
+        async for _ in ai_agent.process_message("Muchas gracias."):
+            pass
+
+        await asyncio.sleep(0)
+        assert task.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_replay_of_cancelled_buffer_ends(self, ai_agent):
+        """Replaying a speculation cancelled before it ran should fail, not hang"""
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(text_events("Claro.")))
+
+        ai_agent.speculate_partial("Quiero una cita.")
+        task, events = ai_agent._take_speculation("Quiero una cita.")
+        task.cancel()
+
+        with pytest.raises(RuntimeError):
+            async with ai_agent._replay_stream(task, events) as stream:
+                await asyncio.wait_for(stream.__anext__(), timeout=1.0)
+
+    def test_speculation_off_by_default(self, ai_agent, monkeypatch):
+        """SPECULATIVE_RESPONSES is opt-in"""
+        monkeypatch.delenv("SPECULATIVE_RESPONSES", raising=False)
+        with patch("ai_agent.AsyncAnthropic"):
+            agent = AIAgent(knowledge_base=None)
+        agent.client.messages.stream = MagicMock()
+
+        agent.on_partial_transcript("Quiero una cita.")
+
+        assert agent._speculation is None
+        agent.client.messages.stream.assert_not_called()
+
+    def test_incomplete_partial_not_speculated(self, ai_agent):
+        """Partials that don't end a sentence should not open a stream"""
+        ai_agent.client.messages.stream = MagicMock()
+
+        ai_agent.speculate_partial("Quiero una")
+
+        assert ai_agent._speculation is None
+
+
+class TestResponseCache:
+    """Tests for reusing replies to repeated utterances"""
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, monkeypatch):
+        """The cache is opt-in; turn it on for these tests"""
+        monkeypatch.setattr(ai_agent_module, "RESPONSE_CACHE_SIZE", 256)
+
+    @pytest.mark.asyncio
+    async def test_disabled_by_default(self, ai_agent, monkeypatch):
+        """Without RESPONSE_CACHE_SIZE nothing should be cached"""
+        monkeypatch.setattr(ai_agent_module, "RESPONSE_CACHE_SIZE", 0)
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Abrimos de 9 a 17."))
+        )
+        async for _ in ai_agent.process_message("¿Cuál es su horario?"):
+            pass
+
+        assert ai_agent_module._response_cache == {}
+
+    @pytest.mark.asyncio
+    async def test_repeat_in_same_context_skips_claude(self, ai_agent):
+        """A new call opening with the same question should get the cached reply"""
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Abrimos de 9 a 17."))
+        )
+        async for _ in ai_agent.process_message("¿Cuál es su horario?"):
+            pass
+
+        with patch("ai_agent.AsyncAnthropic"):
+            second = AIAgent(knowledge_base=None)
+        second.client.messages.stream = MagicMock()
+        chunks = [c async for c in second.process_message("Cuál es su horario.") if c["type"] == "text"]
+
+        second.client.messages.stream.assert_not_called()
+        assert [c["content"] for c in chunks] == ["Abrimos de 9 a 17."]
+        assert second.conversation_history[-1] == {"role": "assistant", "content": "Abrimos de 9 a 17."}
+
+    @pytest.mark.asyncio
+    async def test_expired_reply_misses(self, ai_agent, monkeypatch):
+        """A reply older than RESPONSE_CACHE_TTL should go back to Claude"""
+        monkeypatch.setattr(ai_agent_module, "RESPONSE_CACHE_TTL", 0.0)
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Abrimos de 9 a 17."))
+        )
+        async for _ in ai_agent.process_message("¿Cuál es su horario?"):
+            pass
+        ai_agent.conversation_history = []
+        async for _ in ai_agent.process_message("¿Cuál es su horario?"):
+            pass
+
+        assert ai_agent.client.messages.stream.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_truncated_reply_not_cached(self, ai_agent):
+        """A reply cut off at max_tokens should never be replayed"""
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Abrimos de", stop_reason="max_tokens"))
+        )
+        async for _ in ai_agent.process_message("¿Cuál es su horario?"):
+            pass
+
+        assert ai_agent_module._response_cache == {}
+
+    @pytest.mark.asyncio
+    async def test_different_context_misses(self, ai_agent):
+        """The same utterance after a different history should go to Claude"""
+        ai_agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Claro."))
+        )
+        async for _ in ai_agent.process_message("¿Y el sábado?"):
+            pass
+        ai_agent.conversation_history = [
+            {"role": "user", "content": "¿Abren el domingo?"},
+            {"role": "assistant", "content": "No, el domingo cerramos."},
+        ]
+        async for _ in ai_agent.process_message("¿Y el sábado?"):
+            pass
+
+        assert ai_agent.client.messages.stream.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_similar_utterance_reuses_reply(self, monkeypatch):
+        """A differently worded repeat should reuse the reply once its embedding is ready"""
+        monkeypatch.setattr(ai_agent_module, "RESPONSE_CACHE_SIMILARITY", 0.95)
+        vectors = {
+            "¿Cuál es su horario?": [1.0, 0.0],
+            "¿A qué hora abren?": [0.96, 0.28],
+            "¿Cuánto cuesta?": [0.0, 1.0],
+        }
+        kb = MagicMock()
+        kb.documents = [{"id": "1"}]
+        kb.get_all_documents_text.return_value = "\n\nKB: horario 9-17"
+        kb.embed_query = AsyncMock(side_effect=lambda text: np.asarray(vectors[text]))
+
+        opened = []
+
+        def slow_open_stream(**_):
+            # Opening a real stream yields to the loop long enough to embed
+            stream = make_stream(text_events("Abrimos de 9 a 17."))
+            opened.append(stream)
+
+            async def enter():
+                await asyncio.sleep(0)
+                return stream
+            stream.__aenter__ = AsyncMock(side_effect=enter)
+            return stream
+
+        ai_agent_module._response_cache.clear()
+        with patch("ai_agent.AsyncAnthropic"):
+            first = AIAgent(knowledge_base=kb)
+            second = AIAgent(knowledge_base=kb)
+        # Both agents share the mocked client
+        first.client.messages.stream = MagicMock(side_effect=slow_open_stream)
+
+        async for _ in first.process_message("¿Cuál es su horario?"):
+            pass
+        similar = [c["content"] async for c in second.process_message("¿A qué hora abren?")]
+        assert similar == ["Abrimos de 9 a 17."]
+        # The stream was opened but never read
+        opened[1].__aiter__.assert_not_called()
+
+        second.conversation_history = []
+        async for _ in second.process_message("¿Cuánto cuesta?"):
+            pass
+        opened[2].__aiter__.assert_called_once()
+        assert len(ai_agent_module._response_cache) == 2
+
+    @pytest.mark.asyncio
+    async def test_similarity_off_by_default(self):
+        """Without RESPONSE_CACHE_SIMILARITY no utterance should be embedded"""
+        kb = MagicMock()
+        kb.documents = [{"id": "1"}]
+        kb.get_all_documents_text.return_value = "\n\nKB: horario 9-17"
+        kb.embed_query = AsyncMock(return_value=np.asarray([1.0, 0.0]))
+        with patch("ai_agent.AsyncAnthropic"):
+            agent = AIAgent(knowledge_base=kb)
+        agent.client.messages.stream = MagicMock(
+            side_effect=lambda **_: make_stream(text_events("Abrimos de 9 a 17."))
+        )
+        async for _ in agent.process_message("¿Cuál es su horario?"):
+            pass
+
+        kb.embed_query.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_similar_utterance_with_other_weekday_misses(self, monkeypatch):
+        """Close embeddings naming a different day or number should go to Claude"""
+        monkeypatch.setattr(ai_agent_module, "RESPONSE_CACHE_SIMILARITY", 0.95)
+        kb = MagicMock()
+        kb.documents = [{"id": "1"}]
+        kb.get_all_documents_text.return_value = "\n\nKB: horario 9-17"
+        kb.embed_query = AsyncMock(return_value=np.asarray([1.0, 0.0]))
+
+        opened = []
+
+        def slow_open_stream(**_):
+            stream = make_stream(text_events("Sí, abrimos."))
+            opened.append(stream)
+
+            async def enter():
+                await asyncio.sleep(0)
+                return stream
+            stream.__aenter__ = AsyncMock(side_effect=enter)
+            return stream
+
+        with patch("ai_agent.AsyncAnthropic"):
+            agent = AIAgent(knowledge_base=kb)
+        agent.client.messages.stream = MagicMock(side_effect=slow_open_stream)
+
+        for utterance in ("¿Abren el lunes?", "¿Abren el martes?", "¿Abren el martes a las 10?"):
+            agent.conversation_history = []
+            async for _ in agent.process_message(utterance):
+                pass
+
+        assert len(opened) == 3
+        for stream in opened:
+            stream.__aiter__.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_tool_turns_not_cached(self, ai_agent):
+        """Replies that involved a tool call should never be replayed"""
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(tool_use_events("escalate_to_human", '{"reason": "x"}')),
+            make_stream(text_events("Le transfiero.")),
+        ])
+        with patch.object(ai_agent.escalation_handler, 'escalate',
+                          new_callable=AsyncMock, return_value={"success": True}):
+            async for _ in ai_agent.process_message("Quiero hablar con una persona"):
+                pass
+
+        assert ai_agent_module._response_cache == {}
 
 
 class TestToolDefinitions:
@@ -68,6 +528,19 @@ class TestToolDefinitions:
             assert "type" in tool["input_schema"]
             assert tool["input_schema"]["type"] == "object"
 
+    def test_last_tool_is_cache_breakpoint(self, ai_agent):
+        """Only the last tool should carry cache_control"""
+        tools = ai_agent._get_tool_definitions()
+        assert tools[-1]["cache_control"] == {"type": "ephemeral"}
+        assert all("cache_control" not in t for t in tools[:-1])
+
+    def test_system_blocks_shared_between_agents(self, ai_agent):
+        """Agents with the same prompt should reuse one cached system block list"""
+        with patch("ai_agent.AsyncAnthropic"):
+            other = AIAgent(knowledge_base=None)
+        assert other._cached_system is ai_agent._cached_system
+        assert ai_agent._cached_system[0]["cache_control"] == {"type": "ephemeral"}
+
 
 class TestConversationHistory:
     """Tests for conversation history management"""
@@ -91,7 +564,7 @@ class TestConversationHistory:
 
     @pytest.mark.asyncio
     async def test_greeting_then_message_history(self, ai_agent):
-        """After greeting + user message, history should be: assistant, user"""
+        """After greeting + user message, history should open on the user turn"""
         await ai_agent.send_greeting()
 
         mock_stream = AsyncMock()
@@ -103,8 +576,336 @@ class TestConversationHistory:
         async for _ in ai_agent.process_message("Hi there"):
             pass
 
-        assert ai_agent.conversation_history[0]["role"] == "assistant"
-        assert ai_agent.conversation_history[1]["role"] == "user"
+        assert ai_agent.conversation_history == [{"role": "user", "content": "Hi there"}]
+
+
+class TestTextCoalescing:
+    """Tests for merging token deltas into phrase-sized chunks"""
+
+    @pytest.mark.asyncio
+    async def test_deltas_coalesced_at_punctuation(self, ai_agent):
+        """Small deltas should be merged and released at punctuation or stream end"""
+        deltas = ["Cl", "aro", ",", " le", " ayudo", " con", " gusto"]
+        events = [
+            SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=d))
+            for d in deltas
+        ]
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(events))
+
+        chunks = [c["content"] async for c in ai_agent.process_message("¿Tienen horario?") if c["type"] == "text"]
+
+        assert chunks == ["Claro,", " le ayudo con gusto"]
+        assert ai_agent.conversation_history[-1]["content"] == "Claro, le ayudo con gusto"
+
+
+class TestFastPaths:
+    """Tests for formulaic utterances answered without Claude"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("utterance", ["Hola.", "¡Buenos días!", "Muchas gracias.", "Adiós"])
+    async def test_formulaic_utterance_skips_claude(self, ai_agent, utterance):
+        """Greetings, thanks and goodbyes should get a canned reply"""
+        ai_agent.client.messages.stream = MagicMock()
+
+        chunks = [c async for c in ai_agent.process_message(utterance)]
+
+        ai_agent.client.messages.stream.assert_not_called()
+        assert len(chunks) == 1 and chunks[0]["type"] == "text"
+        assert ai_agent.conversation_history[-1] == {"role": "assistant", "content": chunks[0]["content"]}
+
+    @pytest.mark.asyncio
+    async def test_greeting_with_request_goes_to_claude(self, ai_agent):
+        """A greeting followed by a request should still reach Claude"""
+        ai_agent.client.messages.stream = MagicMock(return_value=make_stream(text_events("Claro.")))
+
+        async for _ in ai_agent.process_message("Hola, quiero una cita"):
+            pass
+
+        ai_agent.client.messages.stream.assert_called_once()
+
+
+class TestRawStream:
+    """Tests for streaming turns over raw SSE"""
+
+    @pytest.mark.asyncio
+    async def test_raw_sse_stream(self, ai_agent):
+        """SSE lines should drive process_message like SDK events"""
+        lines = [
+            "event: message_start",
+            'data: {"type": "message_start", "message": {"id": "msg_1"}}',
+            "",
+            'data: {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}',
+            'data: {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Abrimos a las nueve."}}',
+            'data: {"type": "content_block_stop", "index": 0}',
+            'data: {"type": "message_stop"}',
+        ]
+
+        async def aiter_lines():
+            for line in lines:
+                yield line
+
+        response = SimpleNamespace(status_code=200, aiter_lines=aiter_lines)
+        http_client = MagicMock()
+        http_client.stream.return_value.__aenter__ = AsyncMock(return_value=response)
+        http_client.stream.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        ai_agent.raw_stream = True
+        with patch("ai_agent._shared_http_client", return_value=http_client):
+            chunks = [c async for c in ai_agent.process_message("¿A qué hora abren?")]
+
+        assert chunks == [{"type": "text", "content": "Abrimos a las nueve."}]
+        body = json.loads(http_client.stream.call_args.kwargs["content"])
+        assert body["stream"] is True
+        assert body["messages"][-1] == {"role": "user", "content": "¿A qué hora abren?"}
+
+
+class TestHistoryWindow:
+    """Tests for the sliding window of history sent to Claude"""
+
+    def test_short_history_sent_whole(self, ai_agent):
+        """History within the limit should be sent as-is, without a copy"""
+        ai_agent.conversation_history = [
+            {"role": "assistant", "content": "Hola"},
+            {"role": "user", "content": "Hi"},
+        ]
+        assert ai_agent._windowed_history() is ai_agent.conversation_history
+
+    def test_long_history_is_capped(self, ai_agent):
+        """Only the most recent messages should be sent, starting on a user turn"""
+        for i in range(MAX_HISTORY_MESSAGES + 7):
+            role = "user" if i % 2 == 0 else "assistant"
+            ai_agent.conversation_history.append({"role": role, "content": f"msg {i}"})
+
+        window = ai_agent._windowed_history()
+        assert len(window) <= MAX_HISTORY_MESSAGES
+        assert window[0]["role"] == "user"
+        assert window[-1] == ai_agent.conversation_history[-1]
+
+    def test_window_does_not_split_tool_pairs(self, ai_agent):
+        """The window should never open on a tool_use or tool_result message"""
+        for i in range(MAX_HISTORY_MESSAGES):
+            ai_agent.conversation_history.append({"role": "user", "content": f"q {i}"})
+            ai_agent.conversation_history.append({
+                "role": "assistant",
+                "content": [{"type": "tool_use", "id": f"t{i}", "name": "check_appointment", "input": {}}]
+            })
+            ai_agent.conversation_history.append({
+                "role": "user",
+                "content": [{"type": "tool_result", "tool_use_id": f"t{i}", "content": "{}"}]
+            })
+
+        window = ai_agent._windowed_history()
+        assert window[0]["role"] == "user"
+        assert isinstance(window[0]["content"], str)
+
+    @pytest.mark.asyncio
+    async def test_process_message_sends_window(self, ai_agent):
+        """process_message should send the windowed history to Claude"""
+        for i in range(MAX_HISTORY_MESSAGES * 2):
+            role = "user" if i % 2 == 0 else "assistant"
+            ai_agent.conversation_history.append({"role": role, "content": f"msg {i}"})
+
+        mock_stream = AsyncMock()
+        mock_stream.__aenter__ = AsyncMock(return_value=mock_stream)
+        mock_stream.__aexit__ = AsyncMock(return_value=False)
+        mock_stream.__aiter__ = MagicMock(return_value=iter([]))
+        ai_agent.client.messages.stream = MagicMock(return_value=mock_stream)
+
+        async for _ in ai_agent.process_message("Latest"):
+            pass
+
+        sent = ai_agent.client.messages.stream.call_args.kwargs["messages"]
+        assert len(sent) <= MAX_HISTORY_MESSAGES
+        assert sent[-1]["content"] == "Latest"
+
+
+class TestToolFollowUp:
+    """Tests for the response generated after a tool call"""
+
+    @pytest.mark.asyncio
+    async def test_direct_tool_message_skips_follow_up(self, ai_agent):
+        """A lone lookup tool's message should be spoken without a second Claude call"""
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(tool_use_events("check_appointment", '{"phone": "+1234567890"}')),
+            make_stream(text_events("should not be used")),
+        ])
+        with patch.object(ai_agent.appointment_manager, 'check_appointment',
+                          new_callable=AsyncMock,
+                          return_value={"success": False, "message": "No se encontraron citas"}):
+            chunks = [c async for c in ai_agent.process_message("¿Tengo cita?")]
+
+        assert ai_agent.client.messages.stream.call_count == 1
+        texts = [c["content"] for c in chunks if c["type"] == "text"]
+        assert texts == ["No se encontraron citas"]
+        assert ai_agent.conversation_history[-1] == {
+            "role": "assistant", "content": "No se encontraron citas"
+        }
+
+    @pytest.mark.asyncio
+    async def test_booking_confirmation_is_spoken_naturally(self, ai_agent):
+        """A booking should be confirmed with a spoken date and a short code, not ISO text"""
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(tool_use_events(
+                "book_appointment",
+                '{"date": "2026-10-20", "time": "14:00", "name": "Ana", "phone": "1"}')),
+            make_stream(text_events("should not be used")),
+        ])
+        with patch.object(ai_agent.appointment_manager, 'book_appointment',
+                          new_callable=AsyncMock,
+                          return_value={
+                              "success": True, "appointment_id": "APT-20261016120734",
+                              "date": "2026-10-20", "time": "14:00", "name": "Ana",
+                              "message": "Cita confirmada para Ana el 2026-10-20 a las 14:00. "
+                                         "Número de confirmación: APT-20261016120734",
+                          }):
+            chunks = [c async for c in ai_agent.process_message("Quiero una cita")]
+
+        assert ai_agent.client.messages.stream.call_count == 1
+        texts = [c["content"] for c in chunks if c["type"] == "text"]
+        assert texts == [
+            "Listo, su cita queda confirmada para el martes 20 de octubre a las 14:00. "
+            "Su código de confirmación es 0 7 3 4."
+        ]
+
+    @pytest.mark.asyncio
+    async def test_found_appointment_is_spoken_naturally(self, ai_agent):
+        """A lookup hit should read the date as words"""
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(tool_use_events("check_appointment", '{"phone": "1"}')),
+        ])
+        with patch.object(ai_agent.appointment_manager, 'check_appointment',
+                          new_callable=AsyncMock,
+                          return_value={
+                              "success": True,
+                              "appointment": {"id": "APT-1", "date": "2026-03-01", "time": "10:30",
+                                              "name": "Ana", "status": "confirmed"},
+                              "message": "Cita encontrada para Ana el 2026-03-01 a las 10:30",
+                          }):
+            chunks = [c async for c in ai_agent.process_message("¿Tengo cita?")]
+
+        texts = [c["content"] for c in chunks if c["type"] == "text"]
+        assert texts == ["Tiene una cita a nombre de Ana el domingo 1 de marzo a las 10:30."]
+
+    @pytest.mark.asyncio
+    async def test_tool_error_uses_follow_up(self, ai_agent):
+        """Tool errors should go back to Claude for a spoken explanation"""
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(tool_use_events("book_appointment", '{"date": "x", "time": "y", "name": "A", "phone": "1"}')),
+            make_stream(text_events("La fecha no es válida.")),
+        ])
+        with patch.object(ai_agent.appointment_manager, 'book_appointment',
+                          new_callable=AsyncMock,
+                          return_value={"success": False, "error": "Formato de fecha inválido"}):
+            chunks = [c async for c in ai_agent.process_message("Quiero una cita")]
+
+        assert ai_agent.client.messages.stream.call_count == 2
+        texts = [c["content"] for c in chunks if c["type"] == "text"]
+        assert "".join(texts) == "La fecha no es válida."
+
+
+class TestParallelTools:
+    """Tests for multiple tool calls in one turn"""
+
+    @pytest.mark.asyncio
+    async def test_tools_run_concurrently(self, ai_agent):
+        """Each tool should be able to wait on the other, proving they overlap"""
+        booked = asyncio.Event()
+        escalated = asyncio.Event()
+
+        async def book(**kwargs):
+            booked.set()
+            await asyncio.wait_for(escalated.wait(), timeout=1.0)
+            return {"success": True, "message": "Cita confirmada"}
+
+        async def escalate(**kwargs):
+            escalated.set()
+            await asyncio.wait_for(booked.wait(), timeout=1.0)
+            return {"success": True, "message": "Ticket creado"}
+
+        events = (
+            tool_use_events("book_appointment", '{"date": "2030-01-01", "time": "10:00", "name": "A", "phone": "1"}', "toolu_1")
+            + tool_use_events("escalate_to_human", '{"reason": "dolor"}', "toolu_2")
+        )
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(events),
+            make_stream(text_events("Listo.")),
+        ])
+        with patch.object(ai_agent.appointment_manager, 'book_appointment', side_effect=book), \
+             patch.object(ai_agent.escalation_handler, 'escalate', side_effect=escalate):
+            chunks = [c async for c in ai_agent.process_message("Cita y ayuda")]
+
+        tool_chunks = [c for c in chunks if c["type"] == "tool_call"]
+        assert [c["result"]["success"] for c in tool_chunks] == [True, True]
+
+        tool_results = ai_agent.conversation_history[-2]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["toolu_1", "toolu_2"]
+
+
+    @pytest.mark.asyncio
+    async def test_tool_events_in_completion_order(self, ai_agent):
+        """A fast tool should be reported before a slower one called earlier"""
+        release_book = asyncio.Event()
+
+        async def book(**kwargs):
+            await asyncio.wait_for(release_book.wait(), timeout=1.0)
+            return {"success": True, "message": "Cita confirmada"}
+
+        async def escalate(**kwargs):
+            return {"success": True, "message": "Ticket creado"}
+
+        events = (
+            tool_use_events("book_appointment", '{"date": "2030-01-01", "time": "10:00", "name": "A", "phone": "1"}', "toolu_1")
+            + tool_use_events("escalate_to_human", '{"reason": "dolor"}', "toolu_2")
+        )
+        ai_agent.client.messages.stream = MagicMock(side_effect=[
+            make_stream(events),
+            make_stream(text_events("Listo.")),
+        ])
+        tool_names = []
+        with patch.object(ai_agent.appointment_manager, 'book_appointment', side_effect=book), \
+             patch.object(ai_agent.escalation_handler, 'escalate', side_effect=escalate):
+            async for chunk in ai_agent.process_message("Cita y ayuda"):
+                if chunk["type"] == "tool_call":
+                    tool_names.append(chunk["name"])
+                    release_book.set()
+
+        assert tool_names == ["escalate_to_human", "book_appointment"]
+        tool_results = ai_agent.conversation_history[-2]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["toolu_1", "toolu_2"]
+
+
+class TestEarlyToolStart:
+    """Tests for starting tools while Claude is still streaming"""
+
+    @pytest.mark.asyncio
+    async def test_tool_starts_before_stream_ends(self, ai_agent):
+        """A tool should be running once its block closes, before the stream finishes"""
+        started = asyncio.Event()
+
+        async def check(**kwargs):
+            started.set()
+            return {
+                "success": True,
+                "appointment": {"id": "APT-1", "date": "2026-03-01", "time": "10:30",
+                                "name": "Ana", "status": "confirmed"},
+                "message": "Cita encontrada para Ana el 2026-03-01 a las 10:30",
+            }
+
+        async def events():
+            for event in tool_use_events("check_appointment", '{"phone": "1"}'):
+                yield event
+            # Let the tool task run, then check it did before the stream ends
+            await asyncio.sleep(0)
+            assert started.is_set()
+            yield SimpleNamespace(type="message_stop")
+
+        stream = make_stream([])
+        stream.__aiter__ = MagicMock(return_value=events())
+        ai_agent.client.messages.stream = MagicMock(return_value=stream)
+        with patch.object(ai_agent.appointment_manager, 'check_appointment', side_effect=check):
+            chunks = [c async for c in ai_agent.process_message("¿Tengo cita?")]
+
+        assert [c["type"] for c in chunks] == ["tool_call", "text"]
 
 
 class TestToolExecution:
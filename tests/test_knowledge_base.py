@@ -0,0 +1,267 @@
+"""
+Unit tests for KnowledgeBase - document loading and system prompt text
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import numpy as np
+from unittest.mock import patch, MagicMock, AsyncMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import knowledge_base as knowledge_base_module
+from knowledge_base import KnowledgeBase
+
+
+SAMPLE_DOCUMENTS = [
+    {"id": "doc_1", "category": "horarios", "question": "¿Cuál es su horario?", "answer": "De 9 a 5."},
+    {"id": "doc_2", "category": "precios", "question": "¿Cuánto cuesta?", "answer": "Depende del tratamiento."},
+    {"id": "doc_3", "category": "horarios", "question": "¿Abren sábados?", "answer": "No."},
+]
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, monkeypatch):
+    """Create a KnowledgeBase without OpenAI or a real ChromaDB store"""
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
+    with patch("knowledge_base.chromadb"):
+        kb = KnowledgeBase()
+        kb.documents = list(SAMPLE_DOCUMENTS)
+        kb.document_count = len(SAMPLE_DOCUMENTS)
+        yield kb
+
+
+class TestAllDocumentsText:
+    """Tests for the KB text embedded in the system prompt"""
+
+    def test_empty_knowledge_base(self, knowledge_base):
+        """No documents should produce no text"""
+        knowledge_base.documents = []
+        assert knowledge_base.get_all_documents_text() == ""
+
+    def test_groups_by_category(self, knowledge_base):
+        """Documents should be grouped under sorted category headers"""
+        text = knowledge_base.get_all_documents_text()
+        assert text.index("[HORARIOS]") < text.index("[PRECIOS]")
+        assert text.index("¿Abren sábados?") < text.index("[PRECIOS]")
+        assert "A: Depende del tratamiento." in text
+
+    def test_max_chars_caps_text(self, knowledge_base):
+        """A character budget should drop documents that don't fit"""
+        full = knowledge_base.get_all_documents_text()
+        capped = knowledge_base.get_all_documents_text(max_chars=len(full) - 1)
+        assert len(capped) < len(full)
+        assert "¿Cuál es su horario?" in capped
+
+    def test_large_budget_includes_everything(self, knowledge_base):
+        """A budget larger than the text should not change it"""
+        full = knowledge_base.get_all_documents_text()
+        assert knowledge_base.get_all_documents_text(max_chars=10 ** 6) == full
+
+    def test_text_is_memoized(self, knowledge_base):
+        """Repeated calls should return the same string until documents change"""
+        first = knowledge_base.get_all_documents_text()
+        assert knowledge_base.get_all_documents_text() is first
+
+        knowledge_base.documents = SAMPLE_DOCUMENTS[:1]
+        assert "¿Cuánto cuesta?" not in knowledge_base.get_all_documents_text()
+
+
+class TestBatchEmbeddings:
+    """Tests for embedding KB documents in bulk"""
+
+    @pytest.mark.asyncio
+    async def test_batches_preserve_order(self, knowledge_base, monkeypatch):
+        """Texts should be split into batches and vectors returned in input order"""
+        monkeypatch.setattr(knowledge_base_module, "EMBEDDING_BATCH_SIZE", 2)
+
+        async def create(model, input):
+            # Return the batch out of order; index tags restore it
+            data = [SimpleNamespace(index=i, embedding=[float(len(t))]) for i, t in enumerate(input)]
+            return SimpleNamespace(data=list(reversed(data)))
+
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base.openai_client.embeddings.create = AsyncMock(side_effect=create)
+
+        texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+        embeddings = await knowledge_base._generate_embeddings(texts)
+
+        assert embeddings.dtype == np.float32
+        assert embeddings.tolist() == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+        assert knowledge_base.openai_client.embeddings.create.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_cached_embeddings_skip_openai(self, knowledge_base):
+        """Texts embedded once should come from the on-disk cache afterwards"""
+        async def create(model, input):
+            return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[0.5, float(len(t))])
+                                         for i, t in enumerate(input)])
+
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base.openai_client.embeddings.create = AsyncMock(side_effect=create)
+
+        first = await knowledge_base._generate_embeddings(["a", "bb"])
+        second = await knowledge_base._generate_embeddings(["bb", "a", "ccc"])
+
+        assert first.tolist() == [[0.5, 1.0], [0.5, 2.0]]
+        assert second.tolist() == [[0.5, 2.0], [0.5, 1.0], [0.5, 3.0]]
+        # Second call only embeds the new text
+        assert knowledge_base.openai_client.embeddings.create.await_args.kwargs["input"] == ["ccc"]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self, knowledge_base, monkeypatch):
+        """No more than EMBEDDING_MAX_CONCURRENCY requests should run at once"""
+        monkeypatch.setattr(knowledge_base_module, "EMBEDDING_BATCH_SIZE", 1)
+        monkeypatch.setattr(knowledge_base_module, "EMBEDDING_MAX_CONCURRENCY", 2)
+        in_flight = 0
+        peak = 0
+
+        async def create(model, input):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0])])
+
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base.openai_client.embeddings.create = AsyncMock(side_effect=create)
+
+        embeddings = await knowledge_base._generate_embeddings([f"t{i}" for i in range(6)])
+
+        assert len(embeddings) == 6
+        assert peak == 2
+
+
+def chroma_results(doc_id):
+    """Minimal ChromaDB query result for one document"""
+    return {
+        "ids": [[doc_id]],
+        "metadatas": [[{"category": "horarios", "question": "q", "answer": "a"}]],
+        "distances": [[0.1]],
+    }
+
+
+class TestQueryCache:
+    """Tests for reusing recent search results"""
+
+    @pytest.mark.asyncio
+    async def test_exact_repeat_skips_search(self, knowledge_base):
+        """The same question (case and spacing aside) should not hit Chroma twice"""
+        knowledge_base.collection = MagicMock()
+        knowledge_base.collection.query.return_value = chroma_results("doc_1")
+
+        first = await knowledge_base.search("¿Cuál es su horario?")
+        second = await knowledge_base.search("  ¿cuál es  su HORARIO? ")
+
+        assert second == first
+        knowledge_base.collection.query.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_similar_query_reuses_results(self, knowledge_base):
+        """A query whose embedding is nearly identical should reuse cached results"""
+        vectors = {"horario": [1.0, 0.0], "horarios?": [0.999, 0.01], "precio": [0.0, 1.0]}
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base._generate_embedding = AsyncMock(
+            side_effect=lambda q: np.asarray(vectors[q], dtype=np.float32)
+        )
+        knowledge_base.collection = MagicMock()
+        knowledge_base.collection.query.side_effect = [chroma_results("doc_1"), chroma_results("doc_2")]
+
+        first = await knowledge_base.search("horario")
+        similar = await knowledge_base.search("horarios?")
+        different = await knowledge_base.search("precio")
+
+        assert similar == first
+        assert different[0]["id"] == "doc_2"
+        assert knowledge_base.collection.query.call_count == 2
+
+
+class TestEmbedQuery:
+    """Tests for embedding caller utterances"""
+
+    @pytest.mark.asyncio
+    async def test_returns_unit_vector(self, knowledge_base):
+        """Embeddings should be normalized so a dot product is cosine similarity"""
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base._generate_embedding = AsyncMock(return_value=np.asarray([3.0, 4.0], dtype=np.float32))
+
+        vec = await knowledge_base.embed_query("horario")
+
+        assert np.allclose(vec, [0.6, 0.8])
+
+    @pytest.mark.asyncio
+    async def test_none_without_openai_or_on_error(self, knowledge_base):
+        """No client or a failed request should give None rather than raise"""
+        assert await knowledge_base.embed_query("horario") is None
+
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base._generate_embedding = AsyncMock(side_effect=Exception("API down"))
+        assert await knowledge_base.embed_query("horario") is None
+
+
+class TestInlineMode:
+    """Tests for KB_MODE=inline (no embeddings or vector index)"""
+
+    @pytest.mark.asyncio
+    async def test_inline_mode_skips_chroma(self, tmp_path, monkeypatch):
+        """Inline mode should load documents without touching ChromaDB or OpenAI"""
+        monkeypatch.setenv("KB_MODE", "inline")
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        monkeypatch.chdir(tmp_path)
+        kb_path = tmp_path / "kb.json"
+        kb_path.write_text(json.dumps({"documents": SAMPLE_DOCUMENTS}))
+
+        with patch("knowledge_base.chromadb") as chromadb_mock:
+            kb = KnowledgeBase()
+            await kb.initialize(str(kb_path))
+
+        chromadb_mock.PersistentClient.assert_not_called()
+        assert kb.document_count == 3
+        assert "¿Abren sábados?" in kb.get_all_documents_text()
+
+        results = await kb.search("¿abren los sábados?")
+        assert results[0]["id"] == "doc_3"
+
+
+class TestInitialize:
+    """Tests for loading documents into the vector collection"""
+
+    @pytest.mark.asyncio
+    async def test_collection_add_is_batched(self, knowledge_base, tmp_path, monkeypatch):
+        """Documents should be added to ChromaDB in CHROMA_ADD_BATCH_SIZE batches"""
+        monkeypatch.setattr(knowledge_base_module, "CHROMA_ADD_BATCH_SIZE", 2)
+        kb_path = tmp_path / "kb.json"
+        kb_path.write_text(json.dumps({"documents": SAMPLE_DOCUMENTS}))
+        collection = MagicMock()
+        collection.count.return_value = 0
+        knowledge_base.chroma_client.get_or_create_collection.return_value = collection
+
+        await knowledge_base.initialize(str(kb_path))
+
+        batches = [c.kwargs["ids"] for c in collection.add.call_args_list]
+        assert batches == [["doc_1", "doc_2"], ["doc_3"]]
+        assert "embeddings" not in collection.add.call_args.kwargs
+
+    @pytest.mark.asyncio
+    async def test_openai_connection_warmed_up(self, knowledge_base, tmp_path):
+        """A populated collection should still get a warmup embedding request"""
+        kb_path = tmp_path / "kb.json"
+        kb_path.write_text(json.dumps({"documents": SAMPLE_DOCUMENTS}))
+        collection = MagicMock()
+        collection.count.return_value = 3
+        knowledge_base.chroma_client.get_or_create_collection.return_value = collection
+        knowledge_base.openai_client = MagicMock()
+        knowledge_base.openai_client.embeddings.create = AsyncMock()
+
+        await knowledge_base.initialize(str(kb_path))
+        await knowledge_base._warmup_task
+
+        knowledge_base.openai_client.embeddings.create.assert_awaited_once()
+        collection.add.assert_not_called()
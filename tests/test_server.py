@@ -3,12 +3,22 @@ Unit tests for server utilities
 """
 
 import pytest
+import asyncio
+import json
 import os
 import sys
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from server import _find_sentence_boundary
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from fastapi.testclient import TestClient
+
+from server import (
+    app, _MULAW_DECODE, _VAD_THRESHOLD, _audio_rms, _is_voiced, _TwilioWriter,
+    _CLEAR_TEMPLATE, _MARK_TEMPLATE, _MEDIA_PREFIX_TEMPLATE, _MEDIA_SUFFIX,
+    _find_sentence_boundary, _pipe_audio, _process_with_sentence_buffering,
+)
 
 
 class TestFindSentenceBoundary:
@@ -55,3 +65,291 @@ class TestFindSentenceBoundary:
     def test_exclamation_newline(self):
         """Should find boundary at exclamation followed by newline"""
         assert _find_sentence_boundary("Great!\nThanks") == 7
+
+    def test_earliest_boundary_across_punctuation(self):
+        """Should find the earliest boundary regardless of punctuation type"""
+        assert _find_sentence_boundary("Wait! Really. Yes") == 6
+        assert _find_sentence_boundary("Sure? Okay.\nDone") == 6
+
+    def test_search_from_cursor(self):
+        """Should find the next boundary at or after the start index"""
+        text = "First sentence. Second sentence. Third."
+        assert _find_sentence_boundary(text, 16) == 33
+        assert _find_sentence_boundary(text, 33) == -1
+
+
+class TestSentenceBuffering:
+    """Tests for the sentence-by-sentence REST TTS fallback"""
+
+    @pytest.mark.asyncio
+    async def test_sentences_split_across_chunks(self):
+        """Sentences spanning chunks should be spoken whole, with the tail flushed last"""
+        class FakeAgent:
+            async def process_message(self, transcript):
+                for text in ["Hola. ", "Su cita es", " el lunes! Algo", " más"]:
+                    yield {"type": "text", "content": text}
+
+        spoken = []
+
+        async def synthesize(sentence):
+            spoken.append(sentence)
+
+        await _process_with_sentence_buffering(FakeAgent(), "hola", synthesize)
+        assert spoken == ["Hola.", "Su cita es el lunes!", "Algo más"]
+
+    @pytest.mark.asyncio
+    async def test_boundary_straddling_chunks(self):
+        """Punctuation and its trailing space arriving in separate chunks should still split"""
+        class FakeAgent:
+            async def process_message(self, transcript):
+                for text in ["Claro", ".", "", " Le ayudo?", "\nListo"]:
+                    yield {"type": "text", "content": text}
+
+        spoken = []
+
+        async def synthesize(sentence):
+            spoken.append(sentence)
+
+        await _process_with_sentence_buffering(FakeAgent(), "hola", synthesize)
+        assert spoken == ["Claro.", "Le ayudo?", "Listo"]
+
+
+class TestPipeAudio:
+    """Tests for the TTS producer / Twilio sender queue"""
+
+    @pytest.mark.asyncio
+    async def test_forwards_chunks_in_order(self):
+        """All chunks should reach the sender in TTS order"""
+        async def tts():
+            for i in range(20):
+                yield bytes([i])
+
+        sent = []
+
+        async def send(chunk):
+            await asyncio.sleep(0)
+            sent.append(chunk)
+
+        await _pipe_audio(tts(), send)
+        assert sent == [bytes([i]) for i in range(20)]
+
+    @pytest.mark.asyncio
+    async def test_send_error_stops_producer(self):
+        """A failing send should propagate and cancel the TTS producer"""
+        produced = []
+
+        async def tts():
+            for i in range(100):
+                produced.append(i)
+                yield bytes([i])
+
+        async def send(chunk):
+            raise RuntimeError("socket closed")
+
+        with pytest.raises(RuntimeError):
+            await _pipe_audio(tts(), send)
+        await asyncio.sleep(0)
+        assert len(produced) < 100
+
+    @pytest.mark.asyncio
+    async def test_producer_error_propagates(self):
+        """A TTS failure should end the stream and reach the caller"""
+        async def tts():
+            yield b"\x01"
+            raise ValueError("tts failed")
+
+        sent = []
+
+        async def send(chunk):
+            sent.append(chunk)
+
+        with pytest.raises(ValueError):
+            await _pipe_audio(tts(), send)
+        assert sent == [b"\x01"]
+
+
+class TestTwilioWriter:
+    """Tests for the coalescing outbound writer"""
+
+    @staticmethod
+    def make_writer(max_bytes=4000):
+        sent = []
+
+        async def send_media(audio):
+            sent.append(audio)
+
+        async def send_message(message):
+            sent.append(message)
+
+        return _TwilioWriter(send_media, send_message, max_bytes=max_bytes), sent
+
+    @pytest.mark.asyncio
+    async def test_queued_audio_is_merged(self):
+        """Chunks queued together should go out as one media send, followed by the mark"""
+        writer, sent = self.make_writer()
+        for i in range(3):
+            await writer.put_audio(bytes([i]) * 160)
+        await writer.put_message("mark")
+        writer.start()
+        await asyncio.sleep(0.01)
+        await writer.close()
+
+        assert sent == [b"\x00" * 160 + b"\x01" * 160 + b"\x02" * 160, "mark"]
+
+    @pytest.mark.asyncio
+    async def test_batch_size_is_capped(self):
+        """A backlog larger than max_bytes should be split across sends"""
+        writer, sent = self.make_writer(max_bytes=320)
+        for _ in range(4):
+            await writer.put_audio(b"\x01" * 160)
+        writer.start()
+        await asyncio.sleep(0.01)
+        await writer.close()
+
+        assert [len(audio) for audio in sent] == [320, 320]
+
+    @pytest.mark.asyncio
+    async def test_drop_audio_keeps_marks(self):
+        """Interrupts should discard queued audio but not queued marks"""
+        writer, sent = self.make_writer()
+        await writer.put_audio(b"\x01" * 160)
+        await writer.put_message("mark")
+        await writer.put_audio(b"\x02" * 160)
+        writer.drop_audio()
+        writer.start()
+        await asyncio.sleep(0.01)
+        await writer.close()
+
+        assert sent == ["mark"]
+
+    @pytest.mark.asyncio
+    async def test_failed_send_closes_writer(self, caplog):
+        """A send failure should be logged and later items dropped, not queued forever"""
+        async def send_media(audio):
+            raise RuntimeError("socket closed")
+
+        writer = _TwilioWriter(send_media, AsyncMock())
+        with patch("server._WRITER_QUEUE_SIZE", 2):
+            full = _TwilioWriter(send_media, AsyncMock(), max_bytes=160)
+        await writer.put_audio(b"\x01" * 160)
+        writer.start()
+        await asyncio.sleep(0.01)
+
+        assert writer.closed
+        assert "Twilio writer stopped" in caplog.text
+        for _ in range(100):
+            await writer.put_audio(b"\x01" * 160)
+        assert writer._queue.empty()
+
+        # Puts waiting on a full queue are released when the writer fails
+        await full.put_audio(b"\x01" * 160)
+        await full.put_audio(b"\x01" * 160)
+        blocked = [asyncio.create_task(full.put_audio(b"\x01" * 160)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert not any(task.done() for task in blocked)
+        full.start()
+        await asyncio.wait_for(asyncio.gather(*blocked), 1.0)
+        assert full.closed
+
+
+class TestControlMessageTemplates:
+    """Tests for the pre-serialized Twilio control messages"""
+
+    def test_clear_message(self):
+        """The clear template should produce Twilio's clear event"""
+        assert json.loads(_CLEAR_TEMPLATE % "MZ123") == {"event": "clear", "streamSid": "MZ123"}
+
+    def test_mark_message(self):
+        """The mark template should produce Twilio's mark event"""
+        assert json.loads(_MARK_TEMPLATE % ("MZ123", "response_end_2")) == {
+            "event": "mark",
+            "streamSid": "MZ123",
+            "mark": {"name": "response_end_2"},
+        }
+
+    def test_media_message(self):
+        """Prefix + payload + suffix should produce Twilio's media event"""
+        message = _MEDIA_PREFIX_TEMPLATE % "MZ123" + "AQID" + _MEDIA_SUFFIX
+        assert json.loads(message) == {
+            "event": "media",
+            "streamSid": "MZ123",
+            "media": {"payload": "AQID"},
+        }
+
+
+class TestAudioRms:
+    """Tests for the VAD energy measure on mu-law frames"""
+
+    def test_matches_decoded_samples(self):
+        """RMS should equal the root mean square of the decoded PCM samples"""
+        frame = bytes(range(256))
+        expected = (sum(_MULAW_DECODE[b] ** 2 for b in frame) / len(frame)) ** 0.5
+        assert _audio_rms(frame) == pytest.approx(expected)
+
+    def test_silence_and_empty(self):
+        """Mu-law silence (0xFF) and empty frames should have no energy"""
+        assert _audio_rms(b'\xff' * 160) == 0.0
+        assert _audio_rms(b'') == 0.0
+
+    def test_voiced_matches_rms_threshold(self):
+        """The byte-scan early reject should never change the VAD decision"""
+        quiet = bytes(b for b in range(256) if abs(_MULAW_DECODE[b]) <= _VAD_THRESHOLD)
+        loud = bytes(b for b in range(256) if abs(_MULAW_DECODE[b]) > _VAD_THRESHOLD)
+        softest_loud = min(loud, key=lambda b: abs(_MULAW_DECODE[b]))
+        frames = [
+            (quiet * 3)[:160],
+            (loud * 2)[:160],
+            # One loud sample in a quiet frame: scanned, then rejected by RMS
+            b'\xff' * 159 + bytes([softest_loud]),
+            b'\xff' * 160,
+        ]
+        for frame in frames:
+            assert _is_voiced(frame) == (_audio_rms(frame) > _VAD_THRESHOLD)
+        assert not _is_voiced(frames[2])
+
+
+class TestChatEndpoint:
+    """Tests for the text-only /test/chat endpoint"""
+
+    def test_agent_cleaned_up(self, monkeypatch):
+        """Each request's agent should be cleaned up so its background tasks stop"""
+        monkeypatch.setenv("ENABLE_TEST_ENDPOINTS", "true")
+        agent = MagicMock()
+        agent.conversation_history = []
+        agent.send_greeting = AsyncMock()
+        agent.cleanup = AsyncMock()
+
+        async def reply(text):
+            yield {"type": "text", "content": "Hola."}
+        agent.process_message = reply
+
+        with patch("server.AIAgent", return_value=agent):
+            response = TestClient(app).post("/test/chat", json={"text": "Hola"})
+
+        assert response.json()["response"] == "Hola."
+        agent.cleanup.assert_awaited_once()
+
+
+class TestMetrics:
+    """Tests for the Prometheus metrics endpoint"""
+
+    def test_text_exposition_format(self):
+        """Metrics should be served in Prometheus text format, not JSON"""
+        response = TestClient(app).get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "voice_active_calls" in response.text
+        assert "voice_kb_documents" in response.text
+
+    def test_multiprocess_call_count_sums_workers(self):
+        """With PROMETHEUS_MULTIPROC_DIR, /health should count every worker's calls"""
+        from prometheus_client.metrics_core import GaugeMetricFamily
+
+        active = GaugeMetricFamily("voice_active_calls", "Calls currently streaming")
+        active.add_metric([], 3)
+        collector = MagicMock()
+        collector.collect.return_value = [active]
+        with patch("server._METRICS_MULTIPROC", True), \
+                patch("server.multiprocess.MultiProcessCollector", return_value=collector):
+            from server import _active_call_count
+            assert _active_call_count() == 3
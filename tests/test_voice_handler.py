@@ -136,3 +136,89 @@ async def test_callback_does_not_shadow_self(voice_handler):
     assert not handler.transcript_queue.empty()
     transcript = await handler.transcript_queue.get()
     assert transcript == "Test transcript"
+
+
+@pytest.mark.asyncio
+async def test_synthesize_speech_streams_chunks(voice_handler):
+    """Streamed synthesis should yield the non-empty chunks in order"""
+    voice_handler.elevenlabs_client.text_to_speech.convert_as_stream.return_value = iter(
+        [b'\x01' * 160, b'', b'\x02' * 80]
+    )
+    chunks = [chunk async for chunk in voice_handler.synthesize_speech("Hola")]
+    assert chunks == [b'\x01' * 160, b'\x02' * 80]
+
+
+@pytest.mark.asyncio
+async def test_prerender_speech_collects_chunks(voice_handler):
+    """Pre-rendered speech should return all non-empty audio chunks"""
+    voice_handler.elevenlabs_client.text_to_speech.convert_as_stream.return_value = iter(
+        [b'\x01' * 160, b'', b'\x02' * 80]
+    )
+    chunks = await voice_handler.prerender_speech("Hola")
+    assert chunks == [b'\x01' * 160, b'\x02' * 80]
+
+
+@pytest.mark.asyncio
+async def test_prerender_speech_raises_on_error(voice_handler):
+    """Pre-rendering should raise rather than return silence, so it isn't cached"""
+    voice_handler.elevenlabs_client.text_to_speech.convert_as_stream.side_effect = Exception("API down")
+    with pytest.raises(Exception):
+        await voice_handler.prerender_speech("Hola")
+
+
+@pytest.mark.asyncio
+async def test_reset_clears_call_state(voice_handler):
+    """Reset should drop per-call state but keep the API clients"""
+    elevenlabs_client = voice_handler.elevenlabs_client
+    voice_handler.dg_connection = AsyncMock()
+    await voice_handler.transcript_queue.put("leftover")
+    voice_handler.speech_detected.set()
+    voice_handler.on_interim_transcript = lambda text: None
+
+    # Stand-in for a streaming loop still waiting on audio
+    voice_handler.is_transcribing = True
+    voice_handler._transcription_task = asyncio.create_task(asyncio.sleep(60))
+
+    await voice_handler.reset()
+
+    assert voice_handler._transcription_task is None
+    assert voice_handler.dg_connection is None
+    assert voice_handler.is_transcribing is False
+    assert voice_handler.transcript_queue.empty()
+    assert not voice_handler.speech_detected.is_set()
+    assert voice_handler.on_interim_transcript is None
+    assert voice_handler.elevenlabs_client is elevenlabs_client
+
+
+@pytest.mark.asyncio
+async def test_drain_audio_batches_backlog(voice_handler):
+    """Frames queued behind the current one should go to Deepgram in one send"""
+    voice_handler.audio_buffer.put_nowait(b'\x02' * 160)
+    voice_handler.audio_buffer.put_nowait(b'\x03' * 160)
+
+    batch = voice_handler._drain_audio(b'\x01' * 160)
+
+    assert batch == b'\x01' * 160 + b'\x02' * 160 + b'\x03' * 160
+    assert voice_handler.audio_buffer.empty()
+    # Without a backlog the frame is passed through untouched
+    frame = b'\x04' * 160
+    assert voice_handler._drain_audio(frame) is frame
+
+
+@pytest.mark.asyncio
+async def test_feed_audio_streams_to_deepgram(voice_handler):
+    """Frames fed synchronously should reach the Deepgram connection"""
+    connection = AsyncMock()
+    connection.on = MagicMock()
+    connection.start.return_value = True
+    voice_handler.deepgram_client.listen.asynclive.v.return_value = connection
+
+    voice_handler.feed_audio(b'\x01' * 160)
+    voice_handler.feed_audio(b'\x02' * 160)
+    assert voice_handler.is_transcribing is True
+
+    await asyncio.sleep(0.05)
+    await voice_handler.reset()
+
+    sent = b"".join(call.args[0] for call in connection.send.await_args_list)
+    assert sent == b'\x01' * 160 + b'\x02' * 160